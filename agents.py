@@ -3,101 +3,455 @@ AI 智能学习操作系统 - AI Agent 模块
 LangChain-based agents for teaching, assessment, and learning orchestration
 """
 
-from typing import Dict, List, Any, Tuple, Optional
-from langchain_openai import ChatOpenAI
+from typing import AsyncIterator, Dict, FrozenSet, List, Any, Tuple, Optional, Union
 from langchain.schema import HumanMessage, SystemMessage, AIMessage
+import asyncio
+import functools
 import json
+import random
 import re
-
-from config import API_KEY, API_BASE_URL, MODEL_NAME
+import threading
+from itertools import islice
+
+from cachetools import TTLCache
+
+from config import (
+    MODEL_NAME, LLM_TEMPERATURE,
+    LLM_CACHE_SIZE, LLM_CACHE_TTL, LLM_CACHEABLE_TEMPERATURE,
+    SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_TTL, SEMANTIC_CACHE_THRESHOLD,
+    SEMANTIC_CACHE_MAX_TEMPERATURE, PREFETCH_HINTS, HINT_PREFETCH_TTL, REMEDIATION_PREFETCH,
+    HISTORY_KEEP_RECENT, HISTORY_SUMMARIZE_EVERY,
+    HISTORY_MAX_CHARS, HISTORY_SUMMARY_MAX_CHARS, EVAL_JSON_MODE,
+    LLM_MAX_TOKENS, EVAL_STOP,
+    CURRENT_QUESTION_CACHE_SIZE, CURRENT_QUESTION_CACHE_TTL, QUESTION_RANDOM_SEED
+)
 from models import (
     Subject, Question, KnowledgeItem, Session,
     GradeLevel, SessionState, QuestionType
 )
 from database import db
+from cache import ResponseCache, SemanticCache
+from llm_client import get_llm
 
 class BaseAgent:
     """基础 Agent 类"""
 
-    def __init__(self):
-        self.llm = ChatOpenAI(
-            api_key=API_KEY,
-            base_url=API_BASE_URL,
-            model=MODEL_NAME,
-            temperature=0.7,
-            max_tokens=2000
+    def __init__(self, temperature: float = LLM_TEMPERATURE):
+        self.temperature = temperature
+        self.llm = get_llm(temperature)
+        # 按 (max_tokens, stop) 复用绑定后的 LLM，保证同类请求是同一实例，便于合并批量调用
+        self._bound_llms: Dict[Tuple[Optional[int], Optional[Tuple[str, ...]]], Any] = {}
+        self._cache = ResponseCache(maxsize=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL)
+        self._semantic_cache = SemanticCache(
+            maxsize=SEMANTIC_CACHE_SIZE,
+            ttl=SEMANTIC_CACHE_TTL,
+            threshold=SEMANTIC_CACHE_THRESHOLD
         )
+        db.add_knowledge_listener(self._cache.invalidate)
+        db.add_knowledge_listener(self._semantic_cache.invalidate)
+
+    @staticmethod
+    def _to_langchain_messages(messages: List[Dict[str, str]]) -> list:
+        """dict 消息转换为 LangChain 消息"""
+        langchain_messages = []
+        for msg in messages:
+            role = msg.get("role")
+            content = msg.get("content", "")
+            if role == "system":
+                langchain_messages.append(SystemMessage(content=content))
+            elif role == "user":
+                langchain_messages.append(HumanMessage(content=content))
+            elif role == "assistant":
+                langchain_messages.append(AIMessage(content=content))
+        return langchain_messages
+
+    def _llm_for(self, max_tokens: Optional[int] = None, stop: Optional[List[str]] = None) -> Any:
+        """获取按输出上限和停止词绑定的 LLM"""
+        key = (max_tokens, tuple(stop) if stop else None)
+        if key == (None, None):
+            return self.llm
+        llm = self._bound_llms.get(key)
+        if llm is None:
+            params: Dict[str, Any] = {}
+            if max_tokens is not None:
+                params["max_tokens"] = max_tokens
+            if stop:
+                params["stop"] = list(stop)
+            llm = self._bound_llms[key] = self.llm.bind(**params)
+        return llm
+
+    def _cache_key(
+        self,
+        messages: List[Dict[str, str]],
+        cacheable: bool,
+        max_tokens: Optional[int] = None,
+        stop: Optional[List[str]] = None
+    ) -> Optional[bytes]:
+        """低温度调用或调用方显式声明 cacheable 时返回缓存键，否则返回 None"""
+        if cacheable or self.temperature <= LLM_CACHEABLE_TEMPERATURE:
+            return ResponseCache.make_key(MODEL_NAME, self.temperature, messages, max_tokens=max_tokens, stop=stop)
+        return None
+
+    def _lookup_response(
+        self,
+        messages: List[Dict[str, str]],
+        cacheable: bool,
+        max_tokens: Optional[int] = None,
+        stop: Optional[List[str]] = None
+    ) -> Tuple[Optional[bytes], Optional[str]]:
+        """精确匹配缓存查询，返回 (缓存键, 命中内容)
+
+        只按整组消息匹配：提示词模板占了消息的绝大部分，按字面相似度近似匹配
+        会把不同题目的回复当成同一条，近似复用仅用于评估（按题目分桶，见 AssessmentAgent）。
+        """
+        cache_key = self._cache_key(messages, cacheable, max_tokens, stop)
+        if cache_key is None:
+            return None, None
+        return cache_key, self._cache.get(cache_key)
+
+    def _on_llm_response(
+        self,
+        cache_key: Optional[bytes],
+        content: str,
+        usage: Optional[Dict[str, Any]] = None
+    ) -> str:
+        db.increment_interactions()
+        if usage:
+            # 记录服务端前缀缓存命中的输入 token，观察稳定前缀的实际效果
+            details = usage.get("input_token_details") or {}
+            db.record_prompt_usage(usage.get("input_tokens", 0), details.get("cache_read", 0) or 0)
+        if cache_key is not None:
+            self._cache.set(cache_key, content)
+        return content
+
+    async def _acall_llm(
+        self,
+        messages: List[Dict[str, str]],
+        cacheable: bool = False,
+        max_tokens: Optional[int] = None,
+        stop: Optional[List[str]] = None
+    ) -> str:
+        """调用 LLM
+
+        相同消息命中缓存时直接返回，命中缓存不计入 AI 交互次数。
+        """
+        cache_key, cached = self._lookup_response(messages, cacheable, max_tokens, stop)
+        if cached is not None:
+            return cached
 
-    def _call_llm(self, messages: List[Dict[str, str]]) -> str:
-        """调用 LLM"""
         try:
-            langchain_messages = []
-            for msg in messages:
-                role = msg.get("role")
-                content = msg.get("content", "")
-                if role == "system":
-                    langchain_messages.append(SystemMessage(content=content))
-                elif role == "user":
-                    langchain_messages.append(HumanMessage(content=content))
-                elif role == "assistant":
-                    langchain_messages.append(AIMessage(content=content))
-
-            response = self.llm.invoke(langchain_messages)
-            db.increment_interactions()
-            return response.content
+            response = await self._llm_for(max_tokens, stop).ainvoke(self._to_langchain_messages(messages))
+            return self._on_llm_response(cache_key, response.content, response.usage_metadata)
         except Exception as e:
             return f"AI 服务暂时不可用，请检查配置。错误信息：{str(e)}"
 
+    async def _astream_llm(
+        self,
+        messages: List[Dict[str, str]],
+        cacheable: bool = False,
+        max_tokens: Optional[int] = None
+    ) -> AsyncIterator[str]:
+        """流式调用 LLM，逐段产出文本；完整结果照常写入缓存"""
+        cache_key, cached = self._lookup_response(messages, cacheable, max_tokens)
+        if cached is not None:
+            yield cached
+            return
+
+        parts: List[str] = []
+        usage = None
+        try:
+            async for chunk in self._llm_for(max_tokens).astream(self._to_langchain_messages(messages)):
+                if chunk.usage_metadata:
+                    usage = chunk.usage_metadata
+                if chunk.content:
+                    parts.append(chunk.content)
+                    yield chunk.content
+        except Exception as e:
+            yield f"AI 服务暂时不可用，请检查配置。错误信息：{str(e)}"
+            return
+        self._on_llm_response(cache_key, "".join(parts), usage)
 
-class TeachingAgent(BaseAgent):
-    """教学 Agent - 负责启发式教学"""
 
-    SUBJECT_NAMES = {
-        Subject.CHINESE: "语文",
-        Subject.MATH: "数学",
-        Subject.ENGLISH: "英语",
-        Subject.HISTORY: "历史",
-        Subject.POLITICS: "政治"
+@functools.lru_cache(maxsize=16)
+def _knowledge_by_subject(subject: Subject, knowledge_version: int) -> Tuple[KnowledgeItem, ...]:
+    return tuple(db.iter_knowledge(subject=subject))
+
+
+@functools.lru_cache(maxsize=16)
+def _topics_by_subject(subject: Subject, knowledge_version: int) -> Tuple[Dict[str, str], ...]:
+    return tuple(db.get_topics_by_subject(subject))
+
+
+@functools.lru_cache(maxsize=256)
+def _question_pools(
+    subject: Subject,
+    topic_id: Optional[str],
+    questions_version: int
+) -> Tuple[Tuple[Question, ...], Tuple[Question, ...]]:
+    """按 (学科, 主题) 预先划分的 (练习题, 迁移测试题)，题库变更后随版本号失效"""
+    if topic_id:
+        questions = db.get_questions_by_topic(subject, topic_id)
+    else:
+        questions = db.get_questions_by_subject(subject)
+    practice = tuple(q for q in questions if not q.is_transfer)
+    transfer = tuple(q for q in questions if q.is_transfer)
+    return practice, transfer
+
+
+# 抽题用的随机数生成器；配置了种子时同一进程内抽题顺序可复现
+_rng = random.Random(QUESTION_RANDOM_SEED)
+
+
+def get_question_pools(subject: Subject, topic_id: Optional[str] = None) -> Tuple[Tuple[Question, ...], Tuple[Question, ...]]:
+    """获取练习题和迁移测试题（按题库版本缓存，返回只读元组）"""
+    return _question_pools(subject, topic_id, db.questions_version)
+
+
+def get_subject_knowledge(subject: Subject) -> Tuple[KnowledgeItem, ...]:
+    """获取学科知识点（按知识库版本缓存，返回只读元组）"""
+    return _knowledge_by_subject(subject, db.knowledge_version)
+
+
+def get_subject_topics(subject: Subject) -> Tuple[Dict[str, str], ...]:
+    """获取学科主题（按知识库版本缓存，返回只读元组）"""
+    return _topics_by_subject(subject, db.knowledge_version)
+
+
+@functools.lru_cache(maxsize=16)
+def _topic_matcher(subject: Subject, knowledge_version: int) -> Tuple[Optional["re.Pattern[str]"], Dict[str, Any]]:
+    """把主题名称和 id 编译成一个正则，并返回匹配文本到主题 id 的映射"""
+    lookup: Dict[str, Any] = {}
+    for topic in _topics_by_subject(subject, knowledge_version):
+        # topic id 强转为 str，避免 `int in str` TypeError
+        for text in (str(topic.get("name", "")), str(topic.get("id", ""))):
+            if text and text not in lookup:
+                lookup[text] = topic.get("id")
+    if not lookup:
+        return None, lookup
+    # 长词优先，避免短主题名抢先匹配
+    alternation = "|".join(re.escape(t) for t in sorted(lookup, key=len, reverse=True))
+    return re.compile(alternation), lookup
+
+
+def match_topic(subject: Subject, message: str) -> Optional[Any]:
+    """返回消息中最先出现的主题 id，没有则返回 None"""
+    pattern, lookup = _topic_matcher(subject, db.knowledge_version)
+    if pattern is None:
+        return None
+    m = pattern.search(message or "")
+    return lookup[m.group(0)] if m else None
+
+
+@functools.lru_cache(maxsize=16)
+def _keyword_index(subject: Subject, knowledge_version: int) -> Tuple[Optional["re.Pattern[str]"], Dict[str, FrozenSet[str]], FrozenSet[str]]:
+    """把知识点关键词编译成一个正则，返回 (正则, 关键词到知识点 id 的映射, 必然命中的 id)
+
+    正则包在零宽前瞻里，逐位置取最长关键词；同一位置上更短的关键词都是它的前缀，
+    所以每个关键词的 id 集合预先并入其所有前缀关键词的 id，一次扫描即可得到全部命中。
+    """
+    owners: Dict[str, set] = {}
+    always = set()
+    for k in _knowledge_by_subject(subject, knowledge_version):
+        for keyword in k.key_points:
+            if keyword:
+                owners.setdefault(keyword, set()).add(k.id)
+            else:
+                # 空关键词与子串判断一致，视为总是命中
+                always.add(k.id)
+    if not owners:
+        return None, {}, frozenset(always)
+    lookup = {
+        keyword: frozenset().union(*(owners[keyword[:i]] for i in range(1, len(keyword) + 1) if keyword[:i] in owners))
+        for keyword in owners
     }
+    alternation = "|".join(re.escape(t) for t in sorted(lookup, key=len, reverse=True))
+    return re.compile(f"(?=({alternation}))"), lookup, frozenset(always)
 
-    def get_system_prompt(self, subject: Subject, knowledge: List[KnowledgeItem], student_level: GradeLevel = GradeLevel.C) -> str:
-        """生成系统提示词，考虑学生水平"""
-        subject_name = self.SUBJECT_NAMES.get(subject, getattr(subject, "value", str(subject)))
-        
-        # 结构化知识库，增加层级关系
-        knowledge_text = "## 知识点体系\n"
-        topics = {}
-        
-        # 按主题分组知识点
-        for k in knowledge:
-            topic = getattr(k, "topic_name", "其他")
-            if topic not in topics:
-                topics[topic] = []
-            topics[topic].append(k)
-        
-        for topic, items in topics.items():
-            knowledge_text += f"### {topic}\n"
-            for k in items:
-                knowledge_text += f"""
-    - **概念**：{k.title}
-    - **核心内容**：{k.content}
-    - **关键要点**：{', '.join(k.key_points)}
-    - **常见误区**：{', '.join(k.common_mistakes)}
+
+def match_knowledge_ids(subject: Subject, text: str) -> FrozenSet[str]:
+    """返回关键词出现在文本中的知识点 id"""
+    pattern, lookup, always = _keyword_index(subject, db.knowledge_version)
+    if pattern is None:
+        return always
+    hits = set(always)
+    for m in pattern.finditer(text or ""):
+        hits |= lookup[m.group(1)]
+    return frozenset(hits)
+
+
+PRACTICE_KEYWORDS = ["练习", "做题", "测试", "出题", "考考我", "quiz", "test", "practice"]
+HINT_KEYWORDS = ["给我提示", "提示", "hint", "给点提示", "来点提示", "不会", "思路", "怎么做"]
+
+_PRACTICE_RE = re.compile("|".join(map(re.escape, PRACTICE_KEYWORDS)), re.IGNORECASE)
+_HINT_RE = re.compile("|".join(map(re.escape, HINT_KEYWORDS)), re.IGNORECASE)
+
+
+try:
+    # orjson 随 langsmith 安装，解析整段 JSON 比标准库快数倍
+    from orjson import loads as _json_loads
+except ImportError:
+    _json_loads = json.loads
+
+_JSON_DECODER = json.JSONDecoder()
+
+
+def _extract_first_json(text: str, required_keys: Tuple[str, ...] = ()) -> Optional[Dict[str, Any]]:
+    """从 LLM 回复中取出第一个包含必要字段的 JSON 对象
+
+    在每个 "{" 处尝试 raw_decode，能正确处理嵌套对象和字符串里的花括号，
+    且解析失败只跳到下一个 "{"，不会回溯。JSON 模式下整段回复就是一个对象，先整体解析。
+    """
+    stripped = text.strip()
+    if stripped.startswith("{") and stripped.endswith("}"):
+        try:
+            obj = _json_loads(stripped)
+        except ValueError:
+            obj = None
+        if isinstance(obj, dict) and all(key in obj for key in required_keys):
+            return obj
+
+    start = text.find("{")
+    while start != -1:
+        try:
+            obj, _ = _JSON_DECODER.raw_decode(text, start)
+        except ValueError:
+            obj = None
+        if isinstance(obj, dict) and all(key in obj for key in required_keys):
+            return obj
+        start = text.find("{", start + 1)
+    return None
+
+
+JUDGMENT_TRUE_KEYWORDS = frozenset({"正确", "对", "true", "yes", "√"})
+JUDGMENT_FALSE_KEYWORDS = frozenset({"错误", "错", "false", "no", "×"})
+
+_JUDGMENT_TRUE_RE = re.compile("|".join(map(re.escape, JUDGMENT_TRUE_KEYWORDS)))
+_JUDGMENT_FALSE_RE = re.compile("|".join(map(re.escape, JUDGMENT_FALSE_KEYWORDS)))
+
+
+# 中文连续片段，或中文以外的片段（字母、数字、符号）
+_TERM_RE = re.compile(r"[\u4e00-\u9fff]+|[^\u4e00-\u9fff]+")
+# 非中文片段内的词项：数字（含小数、分数）、字母词、运算符；逗号括号只作分隔
+_SYMBOL_TOKEN_RE = re.compile(r"\d+(?:\.\d+)?(?:/\d+)?|[^\W\d_]+|[=<>≤≥≠+\-*/^×÷]|[,，、;；()（）]")
+_NUMBER_RE = re.compile(r"-?\d")
+_SEPARATORS = frozenset(",，、;；()（）")
+_CLOSING = frozenset(")）")
+
+
+def _symbol_tokens(run: str) -> List[str]:
+    """切分非中文片段，保留正负号与运算符
+
+    出现在开头、运算符或分隔符之后的 +/- 视为符号并入后面的数字，"-3/2" 与 "3/2" 不再相同。
+    """
+    tokens: List[str] = []
+    sign = ""
+    prev = None
+    for token in _SYMBOL_TOKEN_RE.findall(run):
+        if token in "+-" and (prev is None or not (prev[-1].isalnum() or prev in _CLOSING)):
+            sign = "-" if token == "-" else ""
+        elif token[0].isdigit():
+            tokens.append(sign + token)
+            sign = ""
+        elif token not in _SEPARATORS:
+            tokens.append(token)
+        prev = token
+    return tokens
+
+
+def _answer_terms(text: str) -> Tuple[FrozenSet[str], FrozenSet[str]]:
+    """把答案切分为比对用的词项，返回 (词项, 锚点)
+
+    中文取相邻二字组（单字保留），其他取数字、字母词和运算符；数字与字母词作为锚点，
+    参考答案的锚点必须全部出现在回答中。
+    """
+    terms = set()
+    anchors = set()
+    for run in _TERM_RE.findall(text):
+        if "\u4e00" <= run[0] <= "\u9fff":
+            if len(run) > 1:
+                terms.update(run[i:i + 2] for i in range(len(run) - 1))
+            else:
+                terms.add(run)
+            continue
+        for token in _symbol_tokens(run):
+            terms.add(token)
+            if token[0].isalpha() or _NUMBER_RE.match(token):
+                anchors.add(token)
+    return frozenset(terms), frozenset(anchors)
+
+
+# 参考答案的词项按答案文本缓存
+_reference_terms = functools.lru_cache(maxsize=1024)(_answer_terms)
+
+
+@functools.lru_cache(maxsize=4096)
+def _simple_check(question_type: str, correct_answer: str, answer: str) -> bool:
+    """规则判分（评估降级时使用）；学生常原样重试同一答案，按 (题型, 参考答案, 回答) 缓存"""
+    correct = correct_answer.lower().strip()
+    student = answer.lower().strip()
+
+    if question_type == QuestionType.CHOICE:
+        return correct in student or student in correct
+
+    if question_type == QuestionType.JUDGMENT:
+        if correct in JUDGMENT_TRUE_KEYWORDS:
+            return bool(_JUDGMENT_TRUE_RE.search(student))
+        return bool(_JUDGMENT_FALSE_RE.search(student))
+
+    # 问答/填空：数字、字母锚点须全部命中，再看参考答案词项的命中率
+    reference, anchors = _reference_terms(correct)
+    if not reference:
+        return False
+    student_terms, _ = _answer_terms(student)
+    if not anchors <= student_terms:
+        return False
+    return len(reference & student_terms) >= len(reference) * 0.5
+
+
+_KNOWLEDGE_ITEM_TEMPLATE = """
+    - **概念**：{title}
+    - **核心内容**：{content}
+    - **关键要点**：{key_points}
+    - **常见误区**：{common_mistakes}
 """
-        
-        # 根据学生水平调整教学策略
-        level_adjustments = {
-            GradeLevel.C: "从最基础的概念开始讲解，使用最简单的语言和大量例子",
-            GradeLevel.B: "可以使用中等难度的讲解，适当引入一些拓展内容",
-            GradeLevel.A: "可以深入讲解概念的本质和应用，挑战学生的思维"
-        }
-        
-        return f"""你是一位专业的{subject_name}学科 AI 导师，具有丰富的教学经验。
+
+
+@functools.lru_cache(maxsize=64)
+def _render_stable_prompt(knowledge_ids: Tuple[str, ...], knowledge_version: int) -> str:
+    """渲染系统提示词的稳定部分
+
+    knowledge_version 只参与缓存键：知识库任何写操作都会使旧条目失效。
+    知识点按 id 排序，保证同一知识库渲染出的前缀逐字节一致。
+    """
+    knowledge = [db.knowledge[kid] for kid in knowledge_ids if kid in db.knowledge]
+
+    # 结构化知识库，增加层级关系
+    topics: Dict[str, List[KnowledgeItem]] = {}
+
+    # 按主题分组知识点
+    for k in knowledge:
+        topics.setdefault(k.topic_name, []).append(k)
+
+    parts = ["## 知识点体系\n"]
+    for topic, items in topics.items():
+        parts.append(f"### {topic}\n")
+        parts.extend(
+            _KNOWLEDGE_ITEM_TEMPLATE.format(
+                title=k.title,
+                content=k.content,
+                key_points=", ".join(k.key_points),
+                common_mistakes=", ".join(k.common_mistakes)
+            )
+            for k in items
+        )
+    knowledge_text = "".join(parts)
+
+    return f"""你是一位专业的学科 AI 导师，具有丰富的教学经验。当前学科和学生水平见「当前教学设置」。
 
 ## 你的教学风格
 1. 采用苏格拉底式提问法，通过连续的引导性问题帮助学生自主思考
 2. 善于用生动的比喻和贴近生活的实例解释抽象概念
-3. 根据学生的理解程度灵活调整教学策略：{level_adjustments.get(student_level, "根据学生反应灵活调整")}
+3. 根据学生的理解程度灵活调整教学策略，具体策略见「当前教学设置」
 4. 鼓励学生提问，营造积极的学习氛围
 5. 对学生的回答给予具体、建设性的反馈
 
@@ -151,34 +505,256 @@ class TeachingAgent(BaseAgent):
 - 在合适的时机引入练习题或拓展问题
 - 回应学生的时候不要展示思考过程，请直接发送要回应的内容"""
 
-    def teach(self, session: Session, user_message: str, knowledge: List[KnowledgeItem]) -> str:
-        """进行教学"""
-        system_prompt = self.get_system_prompt(session.subject, knowledge, session.current_grade)
 
-        messages = [{"role": "system", "content": system_prompt}]
+QUESTION_TYPE_NAMES = {
+    QuestionType.CHOICE: "选择题",
+    QuestionType.JUDGMENT: "判断题",
+    QuestionType.QA: "问答题",
+    QuestionType.FILL: "填空题",
+    QuestionType.APPLICATION: "应用题"
+}
+
+
+@functools.lru_cache(maxsize=1024)
+def _render_question(question_type: str, difficulty: int, content: str, options: Tuple[str, ...]) -> str:
+    """渲染题目文本（按题目内容缓存，题目修改后自然换键）"""
+    parts = [
+        f"【{QUESTION_TYPE_NAMES.get(question_type, '题目')}】难度：{'⭐' * difficulty}\n\n",
+        f"{content}\n"
+    ]
+    if options:
+        parts.append("\n")
+        parts.extend(f"{opt}\n" for opt in options)
+    return "".join(parts)
+
+
+SUBJECT_NAMES = {
+    Subject.CHINESE: "语文",
+    Subject.MATH: "数学",
+    Subject.ENGLISH: "英语",
+    Subject.HISTORY: "历史",
+    Subject.POLITICS: "政治"
+}
+
+
+@functools.lru_cache(maxsize=16)
+def _render_welcome(subject: Subject, knowledge_version: int) -> str:
+    """渲染学科欢迎消息（主题列表随知识库版本变化）"""
+    subject_name = SUBJECT_NAMES.get(subject, getattr(subject, "value", str(subject)))
+    topic_list = "\n".join([f"  • {t.get('name')}" for t in _topics_by_subject(subject, knowledge_version)])
+
+    return f"""👋 欢迎来到 {subject_name} 学习空间！
 
-        # 添加历史消息：保留最近10条
-        for msg in session.messages[-10:]:
+我是你的 AI 学习导师，将陪伴你一起学习和进步。
+
+📚 当前可学习的主题：
+{topic_list}
+
+💡 你可以：
+1. 直接告诉我你想学习什么
+2. 问我任何关于 {subject_name} 的问题
+3. 让我给你出题练习
+
+准备好了吗？让我们开始学习之旅！🚀"""
+
+
+class HistoryBuffer:
+    """教学对话历史
+
+    序列化为 [历史摘要][未摘要的近期原文]。两次摘要之间近期原文只在末尾追加，
+    整个前缀逐字节不变，有利于服务端前缀缓存；未摘要消息达到
+    keep_recent + summarize_every 条时，把较早的部分折叠进摘要。
+    """
+
+    # 每轮对话都会新建，固定属性省去实例 __dict__
+    __slots__ = ("session", "keep_recent", "summarize_every", "max_chars", "pending")
+
+    def __init__(
+        self,
+        session: Session,
+        current_message: Optional[str] = None,
+        keep_recent: int = HISTORY_KEEP_RECENT,
+        summarize_every: int = HISTORY_SUMMARIZE_EVERY,
+        max_chars: int = HISTORY_MAX_CHARS
+    ):
+        self.session = session
+        self.keep_recent = keep_recent
+        self.summarize_every = summarize_every
+        self.max_chars = max_chars
+        # summarized_count 是累计值，扣除已淘汰的条数后才是 deque 内的下标
+        start = max(0, session.summarized_count - session.evicted_count)
+        self.pending = list(islice(session.messages, start, None))
+        # 调度时已把当前用户消息写入历史，由调用方单独追加，这里排除
+        if (current_message is not None and self.pending
+                and self.pending[-1].get("role") == "user"
+                and self.pending[-1].get("content") == current_message):
+            self.pending = self.pending[:-1]
+
+    def truncate(self, content: str) -> str:
+        if len(content) <= self.max_chars:
+            return content
+        return content[:self.max_chars] + "……"
+
+    def needs_summary(self) -> bool:
+        return len(self.pending) >= self.keep_recent + self.summarize_every
+
+    def to_fold(self) -> List[Dict[str, str]]:
+        """需要折叠进摘要的较早消息"""
+        return self.pending[:len(self.pending) - self.keep_recent]
+
+    def apply_summary(self, summary: str, folded: int) -> None:
+        self.session.history_summary = summary
+        self.session.summarized_count += folded
+        self.pending = self.pending[folded:]
+
+    def to_messages(self) -> List[Dict[str, str]]:
+        messages = []
+        if self.session.history_summary:
+            messages.append({"role": "system", "content": f"## 之前的对话摘要\n{self.session.history_summary}"})
+        for msg in self.pending:
             # 只允许三种 role，避免脏数据
             if msg.get("role") in ("system", "user", "assistant"):
-                messages.append({"role": msg["role"], "content": msg.get("content", "")})
+                messages.append({"role": msg["role"], "content": self.truncate(msg.get("content", ""))})
+        return messages
+
+
+async def _concat_stream(prefix: str, stream: AsyncIterator[str], suffix: str = "") -> AsyncIterator[str]:
+    """在流式回复前后拼接固定文本"""
+    if prefix:
+        yield prefix
+    async for delta in stream:
+        yield delta
+    if suffix:
+        yield suffix
+
 
+class TeachingAgent(BaseAgent):
+    """教学 Agent - 负责启发式教学"""
+
+    SUBJECT_NAMES = SUBJECT_NAMES
+
+    # 根据学生水平调整教学策略
+    LEVEL_ADJUSTMENTS = {
+        GradeLevel.C: "从最基础的概念开始讲解，使用最简单的语言和大量例子",
+        GradeLevel.B: "可以使用中等难度的讲解，适当引入一些拓展内容",
+        GradeLevel.A: "可以深入讲解概念的本质和应用，挑战学生的思维"
+    }
+
+    # 错误类型对应的补救教学策略
+    ERROR_STRATEGIES = {
+        "conceptual": "重点解释核心概念，使用直观的比喻和图形化描述",
+        "procedural": "分解解题步骤，展示详细的操作流程",
+        "factual": "提供记忆技巧，使用联想和重复练习",
+        "logical": "培养逻辑思维，使用思维导图和推理训练",
+        "misinterpretation": "加强题目理解训练，提升审题能力"
+    }
+
+    def __init__(self, temperature: float = LLM_TEMPERATURE):
+        super().__init__(temperature)
+        self._context_prompts: Dict[Tuple[Any, Any], str] = {}
+
+    def get_system_prompt(self, knowledge: List[KnowledgeItem]) -> str:
+        """生成稳定的系统提示词前缀（按知识库版本缓存）"""
+        knowledge_ids = tuple(sorted(k.id for k in knowledge))
+        return _render_stable_prompt(knowledge_ids, db.knowledge_version)
+
+    def get_context_prompt(self, subject: Subject, student_level: GradeLevel = GradeLevel.C) -> str:
+        """生成随学科和学生水平变化的动态尾部（组合有限，渲染一次后复用）"""
+        key = (subject, student_level)
+        prompt = self._context_prompts.get(key)
+        if prompt is None:
+            subject_name = self.SUBJECT_NAMES.get(subject, getattr(subject, "value", str(subject)))
+            prompt = self._context_prompts[key] = f"""## 当前教学设置
+- 学科：{subject_name}
+- 教学策略：{self.LEVEL_ADJUSTMENTS.get(student_level, "根据学生反应灵活调整")}"""
+        return prompt
+
+    def get_system_messages(self, subject: Subject, knowledge: List[KnowledgeItem], student_level: GradeLevel = GradeLevel.C) -> List[Dict[str, str]]:
+        """稳定前缀与动态尾部拆成两条 system 消息，便于服务端前缀缓存命中"""
+        return [
+            {"role": "system", "content": self.get_system_prompt(knowledge)},
+            {"role": "system", "content": self.get_context_prompt(subject, student_level)}
+        ]
+
+    def _build_summary_messages(self, history: HistoryBuffer, folded: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """构建历史摘要消息"""
+        dialogue = "\n".join(
+            f"{'学生' if m.get('role') == 'user' else '导师'}：{history.truncate(m.get('content', ''))}"
+            for m in folded
+        )
+        previous = history.session.history_summary or "（无）"
+        prompt = f"""请把下面的辅导对话压缩成不超过{HISTORY_SUMMARY_MAX_CHARS}字的摘要，
+保留：已讲解的知识点、学生的薄弱环节和常见错误、尚未解决的问题。只输出摘要正文。
+
+## 已有摘要
+{previous}
+
+## 新增对话
+{dialogue}"""
+        return [
+            {"role": "system", "content": "你是一位擅长归纳的教学助理。"},
+            {"role": "user", "content": prompt}
+        ]
+
+    async def _asummarize_history(self, history: HistoryBuffer) -> None:
+        """折叠较早的对话；失败时保留原文，下一轮再试"""
+        if not history.needs_summary():
+            return
+        folded = history.to_fold()
+        try:
+            llm = self._llm_for(LLM_MAX_TOKENS["summary"])
+            response = await llm.ainvoke(self._to_langchain_messages(self._build_summary_messages(history, folded)))
+        except Exception as e:
+            db.add_log("error", f"历史摘要失败: {e}", {"session_id": history.session.id})
+            return
+        db.increment_interactions()
+        history.apply_summary(response.content[:HISTORY_SUMMARY_MAX_CHARS], len(folded))
+
+    def _build_teach_messages(self, session: Session, user_message: str, knowledge: List[KnowledgeItem], history: HistoryBuffer) -> List[Dict[str, str]]:
+        """构建教学对话消息：[系统提示][历史摘要][近期原文][当前消息]"""
+        messages = self.get_system_messages(session.subject, knowledge, session.current_grade)
+        messages.extend(history.to_messages())
         messages.append({"role": "user", "content": user_message})
+        return messages
+
+    async def ateach(self, session: Session, user_message: str, knowledge: List[KnowledgeItem]) -> str:
+        """进行教学（异步）"""
+        history = HistoryBuffer(session, user_message)
+        await self._asummarize_history(history)
+        return await self._acall_llm(
+            self._build_teach_messages(session, user_message, knowledge, history),
+            max_tokens=LLM_MAX_TOKENS["teach"]
+        )
 
-        return self._call_llm(messages)
+    async def ateach_stream(self, session: Session, user_message: str, knowledge: List[KnowledgeItem]) -> AsyncIterator[str]:
+        """进行教学（异步流式）"""
+        history = HistoryBuffer(session, user_message)
+        await self._asummarize_history(history)
+        messages = self._build_teach_messages(session, user_message, knowledge, history)
+        async for delta in self._astream_llm(messages, max_tokens=LLM_MAX_TOKENS["teach"]):
+            yield delta
 
-    def generate_remediation(self, session: Session, topic: str, failures: int, error_type: Optional[str] = None) -> str:
-        """生成个性化补救教学内容，基于错误类型和学生水平"""
-        knowledge = db.get_knowledge_by_subject(session.subject)
-        
+    def build_remediation_prompt(
+        self,
+        session: Session,
+        topic: str,
+        failures: int,
+        error_type: Optional[str] = None,
+        defer_error_type: bool = False
+    ) -> str:
+        """构建个性化补救教学要求，基于错误类型和学生水平
+
+        defer_error_type 为 True 时补救与评估在同一次调用中生成，错误类型尚未判定，
+        改为列出各类错误的教学策略，由模型按自己判断的 error_type 选用。
+        """
         # 获取学生最近的答题历史，用于分析常见错误
-        recent_messages = session.messages[-10:]  # 获取最近10条消息
+        recent_messages = list(islice(reversed(session.messages), 10))  # 最近10条消息，新的在前
         answer_history = []
-        for i in range(len(recent_messages) - 1, -1, -2):  # 倒序查找，每两条消息为一组（用户问+系统答）
+        for i in range(0, len(recent_messages), 2):  # 每两条消息为一组（系统答+其前面的用户问）
             if recent_messages[i].get("role") == "assistant" and "错误类型" in recent_messages[i].get("content", ""):
-                if i > 0 and recent_messages[i-1].get("role") == "user":
+                if i + 1 < len(recent_messages) and recent_messages[i+1].get("role") == "user":
                     answer_history.append({
-                        "question": recent_messages[i-1].get("content", ""),
+                        "question": recent_messages[i+1].get("content", ""),
                         "feedback": recent_messages[i].get("content", "")
                     })
             if len(answer_history) >= 3:  # 最多获取3条最近的答题历史
@@ -191,17 +767,18 @@ class TeachingAgent(BaseAgent):
             for i, record in enumerate(answer_history, 1):
                 error_history_text += f"### 错误 {i}\n"
                 error_history_text += f"- 问题：{record['question'][:50]}...\n"
-                error_history_text += f"- 反馈：{record['feedback'].split('\n')[0]}\n"
-        
-        # 定义错误类型对应的教学策略
-        error_strategies = {
-            "conceptual": "重点解释核心概念，使用直观的比喻和图形化描述",
-            "procedural": "分解解题步骤，展示详细的操作流程",
-            "factual": "提供记忆技巧，使用联想和重复练习",
-            "logical": "培养逻辑思维，使用思维导图和推理训练",
-            "misinterpretation": "加强题目理解训练，提升审题能力"
-        }
+                first_line = record['feedback'].split('\n')[0]
+                error_history_text += f"- 反馈：{first_line}\n"
         
+        if defer_error_type:
+            error_type_text = "以评估中判断的 error_type 为准"
+            strategy_text = "按评估中判断的 error_type 选用对应策略：" + "；".join(
+                f"{key}：{strategy}" for key, strategy in self.ERROR_STRATEGIES.items()
+            )
+        else:
+            error_type_text = error_type if error_type else '综合型错误'
+            strategy_text = self.ERROR_STRATEGIES.get(error_type, '采用多样化教学方法')
+
         # 根据学生水平调整补救难度
         level_adjustments = {
             GradeLevel.C: "从最基础的概念重新开始，使用最简单的语言和大量生活实例",
@@ -213,12 +790,12 @@ class TeachingAgent(BaseAgent):
 
 ## 学生信息
 - 当前水平：{session.current_grade.name}（{session.current_grade.value}）
-- 错误类型：{error_type if error_type else '综合型错误'}
+- 错误类型：{error_type_text}
 {error_history_text if error_history_text else ''}
 
 ## 教学策略要求
 1. {level_adjustments.get(session.current_grade, '根据学生水平调整难度')}
-2. {error_strategies.get(error_type, '采用多样化教学方法')}
+2. {strategy_text}
 3. 重新解释核心概念，避免使用复杂术语
 4. 提供3-5个递进式的小步骤练习
 5. 给予积极的鼓励和具体的改进建议
@@ -231,25 +808,59 @@ class TeachingAgent(BaseAgent):
 - **改进建议**：具体的学习方法建议
 
 请生成符合以上要求的补救教学内容："""
+        return prompt
 
-        messages = [
-            {"role": "system", "content": self.get_system_prompt(session.subject, knowledge, session.current_grade)},
-            {"role": "user", "content": prompt}
-        ]
-
-        return self._call_llm(messages)
+    def _build_remediation_messages(
+        self,
+        session: Session,
+        topic: str,
+        failures: int,
+        error_type: Optional[str] = None,
+        knowledge: Optional[List[KnowledgeItem]] = None
+    ) -> List[Dict[str, str]]:
+        """构建补救教学消息"""
+        if knowledge is None:
+            knowledge = get_subject_knowledge(session.subject)
+        messages = self.get_system_messages(session.subject, knowledge, session.current_grade)
+        messages.append({"role": "user", "content": self.build_remediation_prompt(session, topic, failures, error_type)})
+        return messages
+
+    async def agenerate_remediation(
+        self,
+        session: Session,
+        topic: str,
+        failures: int,
+        error_type: Optional[str] = None,
+        knowledge: Optional[List[KnowledgeItem]] = None
+    ) -> str:
+        """生成个性化补救教学内容（异步）"""
+        return await self._acall_llm(
+            self._build_remediation_messages(session, topic, failures, error_type, knowledge),
+            max_tokens=LLM_MAX_TOKENS["remediation"]
+        )
 
-    def generate_hints_for_question(self, session: Session, question: Question, knowledge: List[KnowledgeItem]) -> str:
-        """为特定题目生成分层提示，考虑学生水平"""
+    async def agenerate_remediation_stream(
+        self,
+        session: Session,
+        topic: str,
+        failures: int,
+        error_type: Optional[str] = None,
+        knowledge: Optional[List[KnowledgeItem]] = None
+    ) -> AsyncIterator[str]:
+        """生成个性化补救教学内容（异步流式）"""
+        messages = self._build_remediation_messages(session, topic, failures, error_type, knowledge)
+        async for delta in self._astream_llm(messages, max_tokens=LLM_MAX_TOKENS["remediation"]):
+            yield delta
+
+    def _build_hint_messages(self, session: Session, question: Question, knowledge: List[KnowledgeItem]) -> List[Dict[str, str]]:
+        """构建分层提示消息，考虑学生水平"""
         options_text = ""
-        if getattr(question, "options", None):
+        if question.options:
             options_text = "\n".join([str(o) for o in question.options])
         
-        # 获取相关知识点
-        related_knowledge = []
-        for k in knowledge:
-            if any(keyword in question.content for keyword in k.key_points):
-                related_knowledge.append(k)
+        # 获取相关知识点（按学科预编译的关键词索引，一次扫描题干）
+        related_ids = match_knowledge_ids(session.subject, question.content)
+        related_knowledge = [k for k in knowledge if k.id in related_ids]
         
         knowledge_context = ""
         if related_knowledge:
@@ -280,23 +891,106 @@ class TeachingAgent(BaseAgent):
 提示2（方法指导）: ...
 提示3（检查要点）: ...
 """
-        messages = [
-            {"role": "system", "content": self.get_system_prompt(session.subject, knowledge, session.current_grade)},
-            {"role": "user", "content": prompt}
-        ]
-        return self._call_llm(messages)
+        messages = self.get_system_messages(session.subject, knowledge, session.current_grade)
+        messages.append({"role": "user", "content": prompt})
+        return messages
+
+    async def agenerate_hints_for_question(self, session: Session, question: Question, knowledge: List[KnowledgeItem]) -> str:
+        """为特定题目生成分层提示（异步）"""
+        return await self._acall_llm(
+            self._build_hint_messages(session, question, knowledge),
+            cacheable=True,
+            max_tokens=LLM_MAX_TOKENS["hint"]
+        )
+
+    async def agenerate_hints_stream(self, session: Session, question: Question, knowledge: List[KnowledgeItem]) -> AsyncIterator[str]:
+        """为特定题目生成分层提示（异步流式）"""
+        messages = self._build_hint_messages(session, question, knowledge)
+        async for delta in self._astream_llm(messages, cacheable=True, max_tokens=LLM_MAX_TOKENS["hint"]):
+            yield delta
 
 
 class AssessmentAgent(BaseAgent):
     """评估 Agent - 负责学生回答的深度评估"""
 
-    def evaluate_answer(
+    def __init__(self):
+        # 评估需要确定性输出，温度为 0 时结果可直接缓存
+        super().__init__(temperature=0)
+        if EVAL_JSON_MODE:
+            # 让服务端约束输出为 JSON 对象，减少解析失败导致的降级
+            self.llm = self.llm.bind(response_format={"type": "json_object"})
+        # 只有确定性评估才复用近似回答的结果
+        self._reuse_evaluations = self.temperature <= SEMANTIC_CACHE_MAX_TEMPERATURE
+
+    async def aevaluate_answer(
         self,
         question: Question,
         student_answer: str,
         session: Session
     ) -> Tuple[bool, GradeLevel, str, Optional[str]]:
-        """评估学生回答，增加错误类型分析"""
+        """评估学生回答（异步）"""
+        cached = self._lookup_evaluation(question, student_answer)
+        if cached is not None:
+            return cached
+        response = await self._acall_llm(
+            self._build_evaluation_messages(question, student_answer),
+            max_tokens=LLM_MAX_TOKENS["evaluate"],
+            stop=EVAL_STOP
+        )
+        return self._parse_evaluation(question, student_answer, response)
+
+    async def aevaluate_and_remediate(
+        self,
+        question: Question,
+        student_answer: str,
+        context_messages: List[Dict[str, str]],
+        remediation_prompt: str
+    ) -> Tuple[Tuple[bool, GradeLevel, str, Optional[str]], Optional[str]]:
+        """评估回答，并在同一次调用中让模型为答错的情况生成补救内容
+
+        context_messages 为教学侧的系统提示（学科知识库与学生水平），置于评估消息之前，
+        补救内容与单独生成时依据相同的知识。
+        返回 (评估结果, 补救内容)；答对、命中评估缓存或模型未给出时补救内容为 None。
+        """
+        cached = self._lookup_evaluation(question, student_answer)
+        if cached is not None:
+            return cached, None
+
+        messages = context_messages + self._build_evaluation_messages(question, student_answer)
+        messages[-1]["content"] += f"""
+
+## 补救教学（仅在回答错误时）
+如果学生这次回答错误，请在上述 JSON 中额外加入字段 "remediation"（字符串），内容按以下要求生成；回答正确时该字段为 null。
+
+{remediation_prompt}"""
+        response = await self._acall_llm(
+            messages,
+            max_tokens=LLM_MAX_TOKENS["evaluate"] + LLM_MAX_TOKENS["remediation"],
+            stop=EVAL_STOP
+        )
+
+        result = _extract_first_json(response, self._EVALUATION_KEYS)
+        if result is None:
+            return self._fallback_evaluation(question, student_answer, response), None
+        evaluation = self._evaluation_from_result(question, student_answer, result)
+        remediation = None
+        if not evaluation[0]:
+            remediation = str(result.get("remediation") or "").strip() or None
+        return evaluation, remediation
+
+    @staticmethod
+    def _evaluation_bucket(question: Question) -> tuple:
+        # 题目答案变更后自动换桶
+        return ("assess", question.id, question.correct_answer)
+
+    def _lookup_evaluation(self, question: Question, student_answer: str) -> Optional[Tuple[bool, GradeLevel, str, Optional[str]]]:
+        """同一题目下近似的回答复用评估结果"""
+        if not self._reuse_evaluations:
+            return None
+        return self._semantic_cache.get(self._evaluation_bucket(question), student_answer)
+
+    def _build_evaluation_messages(self, question: Question, student_answer: str) -> List[Dict[str, str]]:
+        """构建评估消息"""
 
         # 增加错误类型分类
         error_types = {
@@ -346,72 +1040,67 @@ class AssessmentAgent(BaseAgent):
             {"role": "system", "content": "你是一位严谨但友善的评估专家，擅长分析学生的学习情况。请用JSON格式输出评估结果，确保包含所有要求的字段。"},
             {"role": "user", "content": prompt}
         ]
+        return messages
 
-        response = self._call_llm(messages)
+    _EVALUATION_KEYS = ("is_correct", "grade", "feedback")
 
-        # 增强JSON解析的鲁棒性
-        try:
-            # 提取JSON部分
-            import json
-            import re
-            
-            # 尝试匹配JSON对象
-            json_pattern = r'\{[\s\S]*?\}'
-            matches = re.findall(json_pattern, response)
-            
-            for match in matches:
-                try:
-                    result = json.loads(match)
-                    # 验证必要字段
-                    if all(key in result for key in ["is_correct", "grade", "feedback"]):
-                        is_correct = bool(result.get("is_correct", False))
-                        grade_str = str(result.get("grade", "C")).strip().upper()
-                        grade = GradeLevel(grade_str) if grade_str in ["A", "B", "C"] else GradeLevel.C
-                        feedback = str(result.get("feedback", "评估完成"))
-                        error_type = result.get("error_type")  # 提取错误类型键
-                        
-                        # 增强反馈内容
-                        if not is_correct:
-                            error_desc = result.get("error_description")
-                            improvement = result.get("improvement_suggestion")
-                            
-                            if error_type and error_desc:
-                                feedback += f"\n\n📌 错误类型：{error_desc}"
-                            if improvement:
-                                feedback += f"\n\n💡 改进建议：{improvement}"
-                        
-                        return is_correct, grade, feedback, error_type
-                except json.JSONDecodeError:
-                    continue
-        except Exception as e:
-            print(f"JSON解析错误: {e}")
+    def _parse_evaluation(
+        self,
+        question: Question,
+        student_answer: str,
+        response: str
+    ) -> Tuple[bool, GradeLevel, str, Optional[str]]:
+        """解析评估结果"""
 
-        # JSON解析失败则简化评估
+        # 增强JSON解析的鲁棒性：取第一个包含必要字段的完整 JSON 对象
+        result = _extract_first_json(response, self._EVALUATION_KEYS)
+        if result is not None:
+            return self._evaluation_from_result(question, student_answer, result)
+        return self._fallback_evaluation(question, student_answer, response)
+
+    def _evaluation_from_result(
+        self,
+        question: Question,
+        student_answer: str,
+        result: Dict[str, Any]
+    ) -> Tuple[bool, GradeLevel, str, Optional[str]]:
+        """由解析出的 JSON 生成评估结果"""
+        is_correct = bool(result.get("is_correct", False))
+        grade_str = str(result.get("grade", "C")).strip().upper()
+        grade = GradeLevel(grade_str) if grade_str in ["A", "B", "C"] else GradeLevel.C
+        feedback = str(result.get("feedback", "评估完成"))
+        error_type = result.get("error_type")  # 提取错误类型键
+
+        # 增强反馈内容
+        if not is_correct:
+            error_desc = result.get("error_description")
+            improvement = result.get("improvement_suggestion")
+
+            if error_type and error_desc:
+                feedback += f"\n\n📌 错误类型：{error_desc}"
+            if improvement:
+                feedback += f"\n\n💡 改进建议：{improvement}"
+
+        evaluation = (is_correct, grade, feedback, error_type)
+        # C 级可能是误判，不缓存以免扩散
+        if self._reuse_evaluations and grade != GradeLevel.C:
+            self._semantic_cache.set(self._evaluation_bucket(question), student_answer, evaluation)
+        return evaluation
+
+    def _fallback_evaluation(
+        self,
+        question: Question,
+        student_answer: str,
+        response: str
+    ) -> Tuple[bool, GradeLevel, str, Optional[str]]:
+        """JSON解析失败则简化评估"""
         is_correct = self._simple_check(question, student_answer)
         grade = GradeLevel.A if is_correct else GradeLevel.C
         return is_correct, grade, response, None
 
     def _simple_check(self, question: Question, answer: str) -> bool:
         """简单答案检查"""
-        correct = str(question.correct_answer).lower().strip()
-        student = str(answer).lower().strip()
-
-        if question.question_type == QuestionType.CHOICE:
-            return correct in student or student in correct
-
-        if question.question_type == QuestionType.JUDGMENT:
-            correct_keywords = ["正确", "对", "true", "yes", "√"]
-            wrong_keywords = ["错误", "错", "false", "no", "×"]
-            if correct in correct_keywords:
-                return any(k in student for k in correct_keywords)
-            return any(k in student for k in wrong_keywords)
-
-        # 问答/填空：关键词命中率
-        keywords = [k for k in correct.split() if k]
-        if not keywords:
-            return False
-        matches = sum(1 for k in keywords if k in student)
-        return matches >= len(keywords) * 0.5
+        return _simple_check(question.question_type, str(question.correct_answer), str(answer))
 
     def generate_feedback(self, question: Question, is_correct: bool, grade: GradeLevel) -> str:
         """生成反馈"""
@@ -431,39 +1120,56 @@ class LearningAgent(BaseAgent):
         self.assessment_agent = AssessmentAgent()
 
         # 关键修复：缓存“当前题目”，避免评估阶段拿错题
-        # 不依赖 Session 模型增加字段
-        self._current_question_by_session: Dict[str, Question] = {}
+        # 题目 id 持久化在 Session.current_question_id 上，这里只是有界的读穿缓存
+        self._current_question_by_session: TTLCache = TTLCache(
+            maxsize=CURRENT_QUESTION_CACHE_SIZE,
+            ttl=CURRENT_QUESTION_CACHE_TTL
+        )
+        self._current_question_lock = threading.RLock()
+        # 出题后在后台预取的提示：session_id -> (question_id, task)
+        # 学生离开后不会再取用，按 TTL 淘汰，避免已完成的任务一直驻留
+        self._hint_tasks: TTLCache = TTLCache(
+            maxsize=CURRENT_QUESTION_CACHE_SIZE,
+            ttl=HINT_PREFETCH_TTL
+        )
 
     def get_welcome_message(self, subject: Subject) -> str:
         """获取欢迎消息"""
-        subject_names = {
-            Subject.CHINESE: "语文",
-            Subject.MATH: "数学",
-            Subject.ENGLISH: "英语",
-            Subject.HISTORY: "历史",
-            Subject.POLITICS: "政治"
-        }
-        subject_name = subject_names.get(subject, getattr(subject, "value", str(subject)))
-
-        topics = db.get_topics_by_subject(subject)
-        topic_list = "\n".join([f"  • {t.get('name')}" for t in topics])
+        return _render_welcome(subject, db.knowledge_version)
 
-        return f"""👋 欢迎来到 {subject_name} 学习空间！
-
-我是你的 AI 学习导师，将陪伴你一起学习和进步。
-
-📚 当前可学习的主题：
-{topic_list}
-
-💡 你可以：
-1. 直接告诉我你想学习什么
-2. 问我任何关于 {subject_name} 的问题
-3. 让我给你出题练习
-
-准备好了吗？让我们开始学习之旅！🚀"""
-
-    def process_message(self, session: Session, user_message: str) -> Dict[str, Any]:
+    async def aprocess_message(self, session: Session, user_message: str) -> Dict[str, Any]:
         """处理用户消息 - 核心调度逻辑"""
+        result = await self._dispatch(session, user_message)
+        self._finish_turn(session, result)
+        return result
+
+    async def aprocess_message_stream(self, session: Session, user_message: str) -> AsyncIterator[Union[str, Dict[str, Any]]]:
+        """流式处理用户消息
+
+        先逐段产出回复文本，最后产出与 aprocess_message 相同的结果字典。
+        教学、提示和补救内容是真正的流式输出，评估结论等其余回复一次性产出。
+        """
+        result = await self._dispatch(session, user_message, stream=True)
+        response_stream = result.pop("response_stream", None)
+        if response_stream is None:
+            self._finish_turn(session, result)
+            yield result["response"]
+            yield result
+            return
+
+        parts: List[str] = []
+        try:
+            async for delta in response_stream:
+                parts.append(delta)
+                yield delta
+        finally:
+            # 客户端中途断开时也保存已生成的部分
+            result["response"] = "".join(parts)
+            self._finish_turn(session, result)
+        yield result
+
+    async def _dispatch(self, session: Session, user_message: str, stream: bool = False) -> Dict[str, Any]:
+        """状态机调度；stream 为 True 时教学、提示、补救等长回复放在 response_stream 中"""
 
         result: Dict[str, Any] = {
             "response": "",
@@ -474,108 +1180,179 @@ class LearningAgent(BaseAgent):
             "mastered": False
         }
 
-        knowledge = db.get_knowledge_by_subject(session.subject)
+        # 本轮对话内只解析一次，随后传给各处理函数
+        knowledge = get_subject_knowledge(session.subject)
 
         # 记录用户消息
-        session.messages.append({"role": "user", "content": user_message})
+        db.append_messages(session, [{"role": "user", "content": user_message}])
 
         # 状态机调度
         if session.state == SessionState.LEARNING:
-            result = self._handle_learning(session, user_message, knowledge)
+            result = await self._handle_learning(session, user_message, knowledge, stream)
         elif session.state == SessionState.ASSESSING:
-            result = self._handle_assessment(session, user_message, knowledge)
+            result = await self._handle_assessment(session, user_message, knowledge, stream)
         elif session.state == SessionState.TRANSFER_TEST:
-            result = self._handle_transfer_test(session, user_message, knowledge)
+            result = await self._handle_transfer_test(session, user_message, knowledge, stream)
         elif session.state == SessionState.REMEDIATION:
-            result = self._handle_remediation(session, user_message, knowledge)
+            result = await self._handle_remediation(session, user_message, knowledge, stream)
 
-        # 记录助手回复
-        session.messages.append({"role": "assistant", "content": result["response"]})
+        return result
 
-        # 更新会话
-        session.state = result["state"]
-        session.current_grade = result["grade"]
+    def _finish_turn(self, session: Session, result: Dict[str, Any]) -> None:
+        """记录回复并更新会话：只写本轮新增的消息和变化的标量字段"""
 
         # db 持久化如果失败，不让它把 /api/chat 直接打成 500（真实错误建议在 FastAPI 层打印）
         try:
-            db.update_session(session)
+            # 记录助手回复
+            db.append_messages(session, [{"role": "assistant", "content": result["response"]}])
+            # 更新会话
+            db.update_session_scalars(
+                session,
+                state=result["state"],
+                current_grade=result["grade"],
+                consecutive_failures=session.consecutive_failures
+            )
         except Exception:
             # 这里吞掉异常，让接口仍能返回（避免用户看到“提示=500”）
             pass
 
-        return result
-
     def _wants_practice(self, message: str) -> bool:
-        keywords = ["练习", "做题", "测试", "出题", "考考我", "quiz", "test", "practice"]
-        m = (message or "").lower()
-        return any(k in m for k in keywords)
+        return bool(_PRACTICE_RE.search(message or ""))
 
     def _wants_hint(self, message: str) -> bool:
         # 在答题态/迁移测试态识别“提示”，不要当作答案去评估
-        m = (message or "").lower()
-        keywords = ["给我提示", "提示", "hint", "给点提示", "来点提示", "不会", "思路", "怎么做"]
-        return any(k in m for k in keywords)
+        return bool(_HINT_RE.search(message or ""))
 
-    def _handle_learning(
+    async def _handle_learning(
         self,
         session: Session,
         user_message: str,
-        knowledge: List[KnowledgeItem]
+        knowledge: List[KnowledgeItem],
+        stream: bool = False
     ) -> Dict[str, Any]:
         """处理学习状态"""
 
         if self._wants_practice(user_message):
-            return self._start_assessment(session)
-
-        # 关键修复：topic id 匹配时强转为 str，避免 `int in str` TypeError 引发 500
-        topics = db.get_topics_by_subject(session.subject)
-        msg = user_message or ""
-        for topic in topics:
-            topic_name = str(topic.get("name", ""))
-            topic_id = str(topic.get("id", ""))  # 强转
-            if (topic_name and topic_name in msg) or (topic_id and topic_id in msg):
-                session.topic_id = topic.get("id")
-                break
+            return self._start_assessment(session, knowledge)
 
-        response = self.teaching_agent.teach(session, user_message, knowledge)
+        topic_id = match_topic(session.subject, user_message)
+        if topic_id is not None:
+            session.topic_id = topic_id
 
-        return {
-            "response": response,
+        result = {
+            "response": "",
             "state": SessionState.LEARNING,
             "grade": session.current_grade,
             "is_question": False,
             "question": None,
             "mastered": False
         }
+        if stream:
+            result["response_stream"] = self.teaching_agent.ateach_stream(session, user_message, knowledge)
+        else:
+            result["response"] = await self.teaching_agent.ateach(session, user_message, knowledge)
+        return result
 
     def _remember_current_question(self, session: Session, question: Question) -> None:
-        sid = getattr(session, "id", None)
-        if sid:
-            self._current_question_by_session[sid] = question
+        session.current_question_id = question.id
+        with self._current_question_lock:
+            self._current_question_by_session[session.id] = question
 
     def _get_current_question(self, session: Session, want_transfer: Optional[bool] = None) -> Optional[Question]:
-        sid = getattr(session, "id", None)
-        if not sid:
-            return None
-        q = self._current_question_by_session.get(sid)
-        if not q:
-            return None
+        sid = session.id
+        qid = session.current_question_id
+        with self._current_question_lock:
+            q = self._current_question_by_session.get(sid)
+        if q is None or (qid and q.id != qid):
+            # 缓存过期或由其他进程出的题：按会话上记录的题目 id 回源
+            q = db.get_question(qid) if qid else None
+            if q is None:
+                return None
+            with self._current_question_lock:
+                self._current_question_by_session[sid] = q
         if want_transfer is None:
             return q
-        if bool(getattr(q, "is_transfer", False)) == bool(want_transfer):
+        if q.is_transfer == bool(want_transfer):
             return q
         return None
 
-    def _start_assessment(self, session: Session) -> Dict[str, Any]:
-        """开始评估"""
+    def _prefetch_hints(self, session: Session, question: Question, knowledge: List[KnowledgeItem]) -> None:
+        """出题后立即在后台生成提示，学生请求提示时通常已经就绪"""
+        sid = session.id
+        self._discard_hint_task(sid)
+        if not PREFETCH_HINTS:
+            return
+        task = asyncio.get_running_loop().create_task(
+            self.teaching_agent.agenerate_hints_for_question(session, question, knowledge)
+        )
+        self._hint_tasks[sid] = (question.id, task)
+
+    def _discard_hint_task(self, sid: str) -> None:
+        entry = self._hint_tasks.pop(sid, None)
+        if entry is None:
+            return
+        task = entry[1]
+        # 只能取消当前事件循环中的任务；其他循环的任务直接丢弃
+        if not task.done() and task.get_loop() is asyncio.get_running_loop():
+            task.cancel()
+
+    def _pop_hint_task(self, session: Session, question: Question) -> Optional[asyncio.Task]:
+        """取出该题可用的预取任务（已完成或属于当前事件循环），没有则返回 None"""
+        entry = self._hint_tasks.pop(session.id, None)
+        if entry is None:
+            return None
+        question_id, task = entry
+        if question_id != question.id or task.cancelled():
+            return None
+        if task.done() or task.get_loop() is asyncio.get_running_loop():
+            return task
+        return None
 
-        if session.topic_id:
-            questions = db.get_questions_by_topic(session.subject, session.topic_id)
+    async def _get_hints(self, session: Session, question: Question, knowledge: List[KnowledgeItem]) -> str:
+        """优先使用预取的提示，未命中时现场生成"""
+        task = self._pop_hint_task(session, question)
+        if task is not None:
+            return await task
+        return await self.teaching_agent.agenerate_hints_for_question(session, question, knowledge)
+
+    async def _stream_hints(self, session: Session, question: Question, knowledge: List[KnowledgeItem]) -> AsyncIterator[str]:
+        """流式版 _get_hints：预取结果已有时一次性产出"""
+        task = self._pop_hint_task(session, question)
+        if task is not None:
+            yield await task
+            return
+        async for delta in self.teaching_agent.agenerate_hints_stream(session, question, knowledge):
+            yield delta
+
+    async def _hint_result(
+        self,
+        session: Session,
+        question: Question,
+        knowledge: List[KnowledgeItem],
+        state: SessionState,
+        stream: bool
+    ) -> Dict[str, Any]:
+        """答题中请求提示：返回提示，题目和状态保持不变"""
+        suffix = "\n\n你可以继续作答："
+        result = {
+            "response": "",
+            "state": state,
+            "grade": session.current_grade,
+            "is_question": True,
+            "question": question,
+            "mastered": False
+        }
+        if stream:
+            result["response_stream"] = _concat_stream("", self._stream_hints(session, question, knowledge), suffix)
         else:
-            questions = db.get_questions_by_subject(session.subject)
+            result["response"] = await self._get_hints(session, question, knowledge) + suffix
+        return result
+
+    def _start_assessment(self, session: Session, knowledge: List[KnowledgeItem]) -> Dict[str, Any]:
+        """开始评估"""
 
-        # 过滤掉迁移测试题
-        questions = [q for q in questions if not getattr(q, "is_transfer", False)]
+        # 已排除迁移测试题
+        questions, _ = get_question_pools(session.subject, session.topic_id)
 
         if not questions:
             return {
@@ -587,9 +1364,9 @@ class LearningAgent(BaseAgent):
                 "mastered": False
             }
 
-        import random
-        question = random.choice(questions)
+        question = _rng.choice(questions)
         self._remember_current_question(session, question)
+        self._prefetch_hints(session, question, knowledge)
 
         question_text = self._format_question(question)
 
@@ -603,30 +1380,19 @@ class LearningAgent(BaseAgent):
         }
 
     def _format_question(self, question: Question) -> str:
-        type_names = {
-            QuestionType.CHOICE: "选择题",
-            QuestionType.JUDGMENT: "判断题",
-            QuestionType.QA: "问答题",
-            QuestionType.FILL: "填空题",
-            QuestionType.APPLICATION: "应用题"
-        }
-
-        difficulty = getattr(question, "difficulty", 1) or 1
-        text = f"【{type_names.get(question.question_type, '题目')}】难度：{'⭐' * int(difficulty)}\n\n"
-        text += f"{question.content}\n"
-
-        if getattr(question, "options", None):
-            text += "\n"
-            for opt in question.options:
-                text += f"{opt}\n"
-
-        return text
+        return _render_question(
+            question.question_type,
+            question.difficulty,
+            question.content,
+            tuple(question.options or ())
+        )
 
-    def _handle_assessment(
+    async def _handle_assessment(
         self,
         session: Session,
         user_message: str,
-        knowledge: List[KnowledgeItem]
+        knowledge: List[KnowledgeItem],
+        stream: bool = False
     ) -> Dict[str, Any]:
         """处理评估状态"""
 
@@ -645,23 +1411,45 @@ class LearningAgent(BaseAgent):
 
         # 关键修复：答题态支持“给我提示”，不要当作答案评估
         if self._wants_hint(user_message):
-            hints = self.teaching_agent.generate_hints_for_question(session, question, knowledge)
-            return {
-                "response": f"{hints}\n\n你可以继续作答：",
-                "state": SessionState.ASSESSING,
-                "grade": session.current_grade,
-                "is_question": True,
-                "question": question,
-                "mastered": False
-            }
-
-        is_correct, grade, feedback, error_type = self.assessment_agent.evaluate_answer(question, user_message, session)
+            return await self._hint_result(session, question, knowledge, SessionState.ASSESSING, stream)
+
+        # 再答错一次就会进入补救：按配置与评估合并为一次调用，或与评估并发生成（答对则取消）
+        remediation = None
+        remediation_task = None
+        topic_name = question.topic_name or "当前主题"
+        prefetch = REMEDIATION_PREFETCH if session.consecutive_failures == 2 else "off"
+        if prefetch == "combined":
+            (is_correct, grade, feedback, error_type), remediation = await self.assessment_agent.aevaluate_and_remediate(
+                question,
+                user_message,
+                self.teaching_agent.get_system_messages(session.subject, knowledge, session.current_grade),
+                self.teaching_agent.build_remediation_prompt(
+                    session, topic_name, session.consecutive_failures + 1, defer_error_type=True
+                )
+            )
+        else:
+            if prefetch == "speculative":
+                remediation_task = asyncio.ensure_future(self.teaching_agent.agenerate_remediation(
+                    session,
+                    topic_name,
+                    session.consecutive_failures + 1,
+                    None,
+                    knowledge
+                ))
+            try:
+                is_correct, grade, feedback, error_type = await self.assessment_agent.aevaluate_answer(question, user_message, session)
+            except BaseException:
+                if remediation_task is not None:
+                    remediation_task.cancel()
+                raise
         session.current_grade = grade
 
         if is_correct:
             session.consecutive_failures = 0
+            if remediation_task is not None:
+                remediation_task.cancel()
             if grade == GradeLevel.A:
-                return self._start_transfer_test(session, feedback)
+                return self._start_transfer_test(session, feedback, knowledge)
             return {
                 "response": f"{feedback}\n\n继续努力！你想继续学习还是做更多练习？",
                 "state": SessionState.LEARNING,
@@ -675,20 +1463,37 @@ class LearningAgent(BaseAgent):
         session.consecutive_failures += 1
 
         if session.consecutive_failures >= 3:
-            remediation = self.teaching_agent.generate_remediation(
-                session,
-                getattr(question, "topic_name", "当前主题"),
-                session.consecutive_failures,
-                error_type
-            )
-            return {
-                "response": f"{feedback}\n\n---\n\n🔄 让我换一种方式来帮助你理解：\n\n{remediation}",
+            prefix = f"{feedback}\n\n---\n\n🔄 让我换一种方式来帮助你理解：\n\n"
+            result = {
+                "response": "",
                 "state": SessionState.REMEDIATION,
                 "grade": GradeLevel.C,
                 "is_question": False,
                 "question": None,
                 "mastered": False
             }
+            if remediation_task is not None:
+                remediation = await remediation_task
+            if remediation is None and stream:
+                # 评估结论先推给前端，补救内容边生成边输出
+                result["response_stream"] = _concat_stream(prefix, self.teaching_agent.agenerate_remediation_stream(
+                    session,
+                    topic_name,
+                    session.consecutive_failures,
+                    error_type,
+                    knowledge
+                ))
+                return result
+            if remediation is None:
+                remediation = await self.teaching_agent.agenerate_remediation(
+                    session,
+                    topic_name,
+                    session.consecutive_failures,
+                    error_type,
+                    knowledge
+                )
+            result["response"] = prefix + remediation
+            return result
 
         # 仍然留在答题态，方便“给我提示/继续作答”
         return {
@@ -700,13 +1505,10 @@ class LearningAgent(BaseAgent):
             "mastered": False
         }
 
-    def _start_transfer_test(self, session: Session, prev_feedback: str) -> Dict[str, Any]:
+    def _start_transfer_test(self, session: Session, prev_feedback: str, knowledge: List[KnowledgeItem]) -> Dict[str, Any]:
         """开始迁移测试"""
 
-        if session.topic_id:
-            transfer_questions = db.get_transfer_questions(session.subject, session.topic_id)
-        else:
-            transfer_questions = [q for q in db.get_questions_by_subject(session.subject) if getattr(q, "is_transfer", False)]
+        _, transfer_questions = get_question_pools(session.subject, session.topic_id)
 
         if not transfer_questions:
             return {
@@ -718,9 +1520,9 @@ class LearningAgent(BaseAgent):
                 "mastered": True
             }
 
-        import random
-        question = random.choice(transfer_questions)
+        question = _rng.choice(transfer_questions)
         self._remember_current_question(session, question)
+        self._prefetch_hints(session, question, knowledge)
 
         question_text = self._format_question(question)
 
@@ -733,11 +1535,12 @@ class LearningAgent(BaseAgent):
             "mastered": False
         }
 
-    def _handle_transfer_test(
+    async def _handle_transfer_test(
         self,
         session: Session,
         user_message: str,
-        knowledge: List[KnowledgeItem]
+        knowledge: List[KnowledgeItem],
+        stream: bool = False
     ) -> Dict[str, Any]:
         """处理迁移测试"""
 
@@ -753,17 +1556,9 @@ class LearningAgent(BaseAgent):
             }
 
         if self._wants_hint(user_message):
-            hints = self.teaching_agent.generate_hints_for_question(session, question, knowledge)
-            return {
-                "response": f"{hints}\n\n你可以继续作答：",
-                "state": SessionState.TRANSFER_TEST,
-                "grade": session.current_grade,
-                "is_question": True,
-                "question": question,
-                "mastered": False
-            }
+            return await self._hint_result(session, question, knowledge, SessionState.TRANSFER_TEST, stream)
 
-        is_correct, grade, feedback = self.assessment_agent.evaluate_answer(question, user_message, session)
+        is_correct, grade, feedback, _ = await self.assessment_agent.aevaluate_answer(question, user_message, session)
 
         if is_correct or grade in [GradeLevel.A, GradeLevel.B]:
             return {
@@ -784,28 +1579,30 @@ class LearningAgent(BaseAgent):
             "mastered": False
         }
 
-    def _handle_remediation(
+    async def _handle_remediation(
         self,
         session: Session,
         user_message: str,
-        knowledge: List[KnowledgeItem]
+        knowledge: List[KnowledgeItem],
+        stream: bool = False
     ) -> Dict[str, Any]:
         """处理补救教学"""
 
         session.consecutive_failures = 0
-        response = self.teaching_agent.teach(session, user_message, knowledge)
-
-        return {
-            "response": response,
+        result = {
+            "response": "",
             "state": SessionState.LEARNING,
             "grade": GradeLevel.C,
             "is_question": False,
             "question": None,
             "mastered": False
         }
+        if stream:
+            result["response_stream"] = self.teaching_agent.ateach_stream(session, user_message, knowledge)
+        else:
+            result["response"] = await self.teaching_agent.ateach(session, user_message, knowledge)
+        return result
 
 
 # 创建全局 Agent 实例
 learning_agent = LearningAgent()
-teaching_agent = TeachingAgent()
-assessment_agent = AssessmentAgent()
@@ -3,13 +3,27 @@ AI 智能学习操作系统 - FastAPI 后端
 Backend API server with RESTful endpoints
 """
 
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List, Optional
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
+from typing import Any, AsyncIterator, Dict, List, Optional
+from urllib.parse import urlencode
+import hashlib
+import json
 import uvicorn
 import traceback
 
-from config import BACKEND_HOST, BACKEND_PORT, SYSTEM_NAME, SYSTEM_VERSION
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from config import (
+    ALLOWED_ORIGINS, BACKEND_ACCESS_LOG, BACKEND_HOST, BACKEND_PORT, BACKEND_WORKERS,
+    SUBJECTS, SYSTEM_NAME, SYSTEM_VERSION
+)
 from models import (
     Subject, Question, KnowledgeItem, Session,
     QuestionType, GradeLevel, SessionState,
@@ -20,23 +34,41 @@ from models import (
 )
 from database import db
 from agents import learning_agent
+from llm_client import aclose_llm_client
+
+# 学科展示信息（静态，取自 config.SUBJECTS），模块加载时构建一次
+SUBJECT_INFO = tuple(
+    {"id": s.id, "name": s.name, "icon": s.icon, "color": s.color} for s in SUBJECTS
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await aclose_llm_client()
 
 app = FastAPI(
     title=SYSTEM_NAME,
     description="AI 辅助学习系统 API",
     version=SYSTEM_VERSION,
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan,
+    # 列表接口的 JSON 编码占响应耗时大头，有 orjson 时改用其 C 实现
+    default_response_class=ORJSONResponse if orjson is not None else JSONResponse
 )
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=ALLOWED_ORIGINS,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST", "PUT", "DELETE"],
+    allow_headers=["content-type", "if-none-match"],
+    expose_headers=["etag", "x-total-count"],
 )
 
+# 题目/知识点列表等 JSON 字段名大量重复，压缩比高；SSE 响应会被自动排除，不影响流式输出
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 @app.get("/")
 async def root():
     return {
@@ -60,13 +92,11 @@ async def create_session(request: CreateSessionRequest):
     session = db.create_session(request.student_id, request.subject)
     welcome = learning_agent.get_welcome_message(request.subject)
 
-    session.messages.append({"role": "assistant", "content": welcome})
-
     # 防止 DB 持久化异常把接口打挂
     try:
-        db.update_session(session)
+        db.append_messages(session, [{"role": "assistant", "content": welcome}])
     except Exception as e:
-        print("[create_session] db.update_session failed:", repr(e))
+        print("[create_session] db.append_messages failed:", repr(e))
         print(traceback.format_exc())
 
     return CreateSessionResponse(
@@ -90,23 +120,15 @@ async def chat(request: ChatRequest):
 
     # 关键：捕获 agents 层的真实异常，否则前端只能看到“500 API请求失败”
     try:
-        result = learning_agent.process_message(session, request.message)
+        result = await learning_agent.aprocess_message(session, request.message)
     except Exception as e:
-        print("[/api/chat] process_message failed:", repr(e))
+        print("[/api/chat] aprocess_message failed:", repr(e))
         print(traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
 
     # 这里让 Pydantic 自行把 Enum/Model 做校验与序列化
     try:
-        return ChatResponse(
-            session_id=session.id,
-            response=result["response"],
-            state=result["state"],
-            grade=result["grade"],
-            is_question=result["is_question"],
-            question=result.get("question"),
-            mastered=result["mastered"]
-        )
+        return _build_chat_response(session, result)
     except Exception as e:
         # 如果 response_model 校验失败，这里能打印出原因（否则也是 500）
         print("[/api/chat] ChatResponse validation/build failed:", repr(e))
@@ -114,32 +136,94 @@ async def chat(request: ChatRequest):
         print(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"ChatResponse build error: {str(e)}")
 
+def _build_chat_response(session: Session, result: Dict[str, Any]) -> ChatResponse:
+    return ChatResponse(
+        session_id=session.id,
+        response=result["response"],
+        state=result["state"],
+        grade=result["grade"],
+        is_question=result["is_question"],
+        question=result.get("question"),
+        mastered=result["mastered"]
+    )
+
+def _sse(payload: Dict[str, Any]) -> str:
+    # 每个增量都要序列化一次，优先用 orjson
+    data = orjson.dumps(payload).decode("utf-8") if orjson is not None else json.dumps(payload, ensure_ascii=False)
+    return f"data: {data}\n\n"
+
+@app.post("/api/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """SSE 流式对话：先推送 {"delta": 文本}，最后推送 {"done": true, "result": ChatResponse}"""
+    session = db.get_session(request.session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    async def event_stream() -> AsyncIterator[str]:
+        try:
+            async for item in learning_agent.aprocess_message_stream(session, request.message):
+                if isinstance(item, str):
+                    yield _sse({"delta": item})
+                else:
+                    result = _build_chat_response(session, item).model_dump(mode="json")
+                    yield _sse({"done": True, "result": result})
+        except Exception as e:
+            print("[/api/chat/stream] aprocess_message_stream failed:", repr(e))
+            print(traceback.format_exc())
+            yield _sse({"error": str(e)})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def _not_modified(request: Request, response: Response, tag: str) -> Optional[Response]:
+    """写入 ETag；与客户端 If-None-Match 一致时返回 304，省去序列化与响应体
+
+    ETag 由数据版本 tag 与路径、排序后的查询参数共同决定，不同筛选条件和分页各自校验。
+    """
+    resource = f"{request.url.path}?{urlencode(sorted(request.query_params.multi_items()))}"
+    etag = f'W/"{tag}-{hashlib.blake2b(resource.encode(), digest_size=8).hexdigest()}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return None
+
+def _paginate(items: List[Any], response: Response, limit: Optional[int], offset: int) -> List[Any]:
+    """按 limit/offset 截取一页，总条数放在 X-Total-Count 头里；未传 limit 时返回 offset 之后的全部"""
+    response.headers["X-Total-Count"] = str(len(items))
+    return items[offset:offset + limit] if limit is not None else items[offset:]
+
 @app.get("/api/sessions/{session_id}/messages")
 async def get_messages(session_id: str):
     session = db.get_session(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
-    return {"messages": session.messages}
+    # messages 是定长 deque，显式转成 list 交给 JSON 编码
+    return {"messages": list(session.messages)}
 
 @app.get("/api/questions", response_model=List[Question])
 async def list_questions(
+    request: Request,
+    response: Response,
     subject: Optional[Subject] = None,
     topic_id: Optional[str] = None,
     difficulty: Optional[int] = None,
-    question_type: Optional[QuestionType] = None
+    question_type: Optional[QuestionType] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    offset: int = Query(0, ge=0)
 ):
-    questions = list(db.questions.values())
-
-    if subject:
-        questions = [q for q in questions if q.subject == subject]
-    if topic_id:
-        questions = [q for q in questions if q.topic_id == topic_id]
-    if difficulty:
-        questions = [q for q in questions if q.difficulty == difficulty]
-    if question_type:
-        questions = [q for q in questions if q.question_type == question_type]
-
-    return questions
+    not_modified = _not_modified(request, response, f"questions-{db.questions_version}")
+    if not_modified:
+        return not_modified
+    questions = db.query_questions(
+        subject=subject,
+        topic_id=topic_id,
+        difficulty=difficulty,
+        question_type=question_type
+    )
+    return _paginate(questions, response, limit, offset)
 
 @app.get("/api/questions/{question_id}", response_model=Question)
 async def get_question(question_id: str):
@@ -150,18 +234,8 @@ async def get_question(question_id: str):
 
 @app.post("/api/questions", response_model=Question)
 async def create_question(request: QuestionCreateRequest):
-    question = Question(
-        subject=request.subject,
-        topic_id=request.topic_id,
-        topic_name=request.topic_name,
-        question_type=request.question_type,
-        difficulty=request.difficulty,
-        content=request.content,
-        options=request.options,
-        correct_answer=request.correct_answer,
-        explanation=request.explanation,
-        is_transfer=request.is_transfer
-    )
+    # 请求体已通过同一组字段约束校验，直接构造，跳过二次校验
+    question = Question.model_construct(**request.model_dump())
     return db.add_question(question)
 
 @app.put("/api/questions/{question_id}", response_model=Question)
@@ -169,19 +243,7 @@ async def update_question(question_id: str, request: QuestionCreateRequest):
     if question_id not in db.questions:
         raise HTTPException(status_code=404, detail="Question not found")
 
-    question = Question(
-        id=question_id,
-        subject=request.subject,
-        topic_id=request.topic_id,
-        topic_name=request.topic_name,
-        question_type=request.question_type,
-        difficulty=request.difficulty,
-        content=request.content,
-        options=request.options,
-        correct_answer=request.correct_answer,
-        explanation=request.explanation,
-        is_transfer=request.is_transfer
-    )
+    question = Question.model_construct(id=question_id, **request.model_dump())
     return db.update_question(question)
 
 @app.delete("/api/questions/{question_id}")
@@ -192,20 +254,19 @@ async def delete_question(question_id: str):
 
 @app.get("/api/knowledge", response_model=List[KnowledgeItem])
 async def list_knowledge(
+    request: Request,
+    response: Response,
     subject: Optional[Subject] = None,
     topic_id: Optional[str] = None,
-    tag: Optional[str] = None
+    tag: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    offset: int = Query(0, ge=0)
 ):
-    items = list(db.knowledge.values())
-
-    if subject:
-        items = [k for k in items if k.subject == subject]
-    if topic_id:
-        items = [k for k in items if k.topic_id == topic_id]
-    if tag:
-        items = [k for k in items if tag in k.tags]
-
-    return items
+    not_modified = _not_modified(request, response, f"knowledge-{db.knowledge_version}")
+    if not_modified:
+        return not_modified
+    knowledge = db.query_knowledge(subject=subject, topic_id=topic_id, tag=tag)
+    return _paginate(knowledge, response, limit, offset)
 
 @app.get("/api/knowledge/{knowledge_id}", response_model=KnowledgeItem)
 async def get_knowledge(knowledge_id: str):
@@ -216,19 +277,8 @@ async def get_knowledge(knowledge_id: str):
 
 @app.post("/api/knowledge", response_model=KnowledgeItem)
 async def create_knowledge(request: KnowledgeCreateRequest):
-    item = KnowledgeItem(
-        subject=request.subject,
-        topic_id=request.topic_id,
-        topic_name=request.topic_name,
-        title=request.title,
-        content=request.content,
-        key_points=request.key_points,
-        common_mistakes=request.common_mistakes,
-        intuition_pumps=request.intuition_pumps,
-        source_type=request.source_type,
-        source_url=request.source_url,
-        tags=request.tags
-    )
+    # 请求体已通过同一组字段约束校验，直接构造，跳过二次校验
+    item = KnowledgeItem.model_construct(**request.model_dump())
     return db.add_knowledge(item)
 
 @app.put("/api/knowledge/{knowledge_id}", response_model=KnowledgeItem)
@@ -236,20 +286,7 @@ async def update_knowledge(knowledge_id: str, request: KnowledgeCreateRequest):
     if knowledge_id not in db.knowledge:
         raise HTTPException(status_code=404, detail="Knowledge item not found")
 
-    item = KnowledgeItem(
-        id=knowledge_id,
-        subject=request.subject,
-        topic_id=request.topic_id,
-        topic_name=request.topic_name,
-        title=request.title,
-        content=request.content,
-        key_points=request.key_points,
-        common_mistakes=request.common_mistakes,
-        intuition_pumps=request.intuition_pumps,
-        source_type=request.source_type,
-        source_url=request.source_url,
-        tags=request.tags
-    )
+    item = KnowledgeItem.model_construct(id=knowledge_id, **request.model_dump())
     return db.update_knowledge(item)
 
 @app.delete("/api/knowledge/{knowledge_id}")
@@ -259,41 +296,54 @@ async def delete_knowledge(knowledge_id: str):
     return {"status": "deleted", "id": knowledge_id}
 
 @app.get("/api/subjects")
-async def list_subjects():
-    subject_info = {
-        Subject.CHINESE: {"name": "语文", "icon": "📖", "color": "#ef4444"},
-        Subject.MATH: {"name": "数学", "icon": "📐", "color": "#3b82f6"},
-        Subject.ENGLISH: {"name": "英语", "icon": "🌍", "color": "#22c55e"},
-        Subject.HISTORY: {"name": "历史", "icon": "🏛️", "color": "#f59e0b"},
-        Subject.POLITICS: {"name": "政治", "icon": "⚖️", "color": "#8b5cf6"}
-    }
-
-    result = []
-    for subj, info in subject_info.items():
-        stats = db.get_stats()["subject_stats"].get(subj.value, {})
-        result.append({
-            "id": subj.value,
-            "name": info["name"],
-            "icon": info["icon"],
-            "color": info["color"],
-            "question_count": stats.get("questions", 0),
-            "knowledge_count": stats.get("knowledge", 0)
-        })
-
-    return result
+async def list_subjects(request: Request, response: Response):
+    not_modified = _not_modified(
+        request, response, f"subjects-{db.knowledge_version}-{db.questions_version}"
+    )
+    if not_modified:
+        return not_modified
+    stats_map = db.get_subject_stats()
+    return [
+        {
+            **base,
+            "question_count": stats_map.get(base["id"], {}).get("questions", 0),
+            "knowledge_count": stats_map.get(base["id"], {}).get("knowledge", 0)
+        }
+        for base in SUBJECT_INFO
+    ]
 
 @app.get("/api/subjects/{subject}/topics")
-async def list_topics(subject: Subject):
+async def list_topics(subject: Subject, request: Request, response: Response):
+    not_modified = _not_modified(request, response, f"topics-{db.knowledge_version}")
+    if not_modified:
+        return not_modified
     return db.get_topics_by_subject(subject)
 
 @app.get("/api/admin/stats", response_model=DashboardStats)
-async def get_stats():
+async def get_stats(request: Request, response: Response):
+    # 统计里的计数只在题库/知识库写入、新建会话和 LLM 调用时变化
+    tag = (
+        f"stats-{db.knowledge_version}-{db.questions_version}-"
+        f"{len(db.sessions)}-{db.ai_interactions}-{db.prompt_tokens}"
+    )
+    not_modified = _not_modified(request, response, tag)
+    if not_modified:
+        return not_modified
     stats = db.get_stats()
     return DashboardStats(**stats)
 
 @app.get("/api/admin/logs", response_model=List[SystemLog])
-async def get_logs(limit: int = 20):
-    return db.get_recent_logs(limit)
+async def get_logs(
+    request: Request,
+    response: Response,
+    limit: int = 20,
+    offset: int = Query(0, ge=0),
+    since: Optional[int] = Query(None, ge=0)
+):
+    not_modified = _not_modified(request, response, f"logs-{db.logs_version}")
+    if not_modified:
+        return not_modified
+    return db.get_recent_logs(limit, offset, since)
 
 def start_server():
     print(f"""
@@ -307,7 +357,13 @@ def start_server():
 ║                                                              ║
 ╚══════════════════════════════════════════════════════════════╝
     """)
-    uvicorn.run(app, host=BACKEND_HOST, port=BACKEND_PORT)
+    # 事件循环和 HTTP 解析器使用 uvicorn 的 auto 选择：装了 uvloop/httptools 就会启用
+    if BACKEND_WORKERS > 1:
+        # 多进程需要以导入字符串启动，由各 worker 自行导入并初始化 db 和 Agent
+        uvicorn.run("backend:app", host=BACKEND_HOST, port=BACKEND_PORT, workers=BACKEND_WORKERS,
+                    access_log=BACKEND_ACCESS_LOG)
+    else:
+        uvicorn.run(app, host=BACKEND_HOST, port=BACKEND_PORT, access_log=BACKEND_ACCESS_LOG)
 
 if __name__ == "__main__":
     start_server()
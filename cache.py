@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+AI 智能学习操作系统 - 缓存模块
+In-process caches for LLM responses
+"""
+
+import hashlib
+import json
+import logging
+import math
+import re
+import threading
+from collections import Counter
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from cachetools import TTLCache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+def _dumps_sorted(obj: Any) -> bytes:
+    """键排序的 JSON 序列化；orjson 可用时走 C 实现，对数 KB 的系统提示快数倍"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+    return json.dumps(obj, sort_keys=True, ensure_ascii=False).encode("utf-8")
+
+
+class ResponseCache:
+    """LLM 响应精确匹配缓存（LRU + TTL，线程安全）"""
+
+    def __init__(self, maxsize: int, ttl: int):
+        self._cache: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def make_key(model: str, temperature: float, messages: List[Dict[str, str]], **params: Any) -> bytes:
+        """以 (模型, 温度, 消息, 其他请求参数) 的哈希作为缓存键"""
+        payload = _dumps_sorted({"m": model, "t": temperature, "msgs": messages, "p": params})
+        return hashlib.blake2b(payload, digest_size=16).digest()
+
+    def get(self, key: Hashable) -> Optional[str]:
+        with self._lock:
+            return self._cache.get(key)
+
+    def set(self, key: Hashable, value: str) -> None:
+        with self._lock:
+            self._cache[key] = value
+
+    def invalidate(self, subject: Optional[Any] = None) -> None:
+        """知识库变更时清空缓存
+
+        缓存键由完整消息哈希而来，知识内容变化后旧条目本就不会再命中；
+        这里整体清空只是及时释放这些失效条目，subject 仅用于兼容回调签名。
+        """
+        with self._lock:
+            self._cache.clear()
+
+
+class SemanticCache:
+    """近似匹配缓存
+
+    按桶（如 ("assess", 题目ID)）存放文本及其结果，查询时在同一桶内
+    计算字符 n-gram 余弦相似度，不低于阈值即视为同一回答。
+    数字、字母等关键符号必须完全一致，避免 "x=3" 与 "x=5" 互相命中；
+    否定词同样作为锚点，"是表达思乡之情" 与 "不是表达思乡之情" 不会互相命中。
+    """
+
+    _PUNCT_RE = re.compile(r"[\s\.,;:!?，。；：！？、\"'“”‘’（）()\[\]【】]+")
+    _ANCHOR_RE = re.compile(r"[a-z]+|-?\d+(?:\.\d+)?|[不没非未无否别勿莫]")
+
+    def __init__(self, maxsize: int, ttl: int, threshold: float, max_per_bucket: int = 64):
+        self._buckets: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.RLock()
+        self.threshold = threshold
+        self.max_per_bucket = max_per_bucket
+
+    @classmethod
+    def _normalize(cls, text: str) -> str:
+        return cls._PUNCT_RE.sub("", str(text).lower())
+
+    @staticmethod
+    def _vectorize(text: str) -> Tuple[Counter, float]:
+        """字符 1-gram + 2-gram 词频向量及其模长"""
+        grams = Counter(text)
+        grams.update(text[i:i + 2] for i in range(len(text) - 1))
+        norm = math.sqrt(sum(v * v for v in grams.values()))
+        return grams, norm
+
+    def _entry(self, text: str) -> Tuple[str, tuple, Counter, float]:
+        normalized = self._normalize(text)
+        anchors = tuple(sorted(self._ANCHOR_RE.findall(normalized)))
+        vec, norm = self._vectorize(normalized)
+        return normalized, anchors, vec, norm
+
+    def get(self, bucket: Hashable, text: str) -> Optional[Any]:
+        normalized, anchors, vec, norm = self._entry(text)
+        if not normalized:
+            return None
+        with self._lock:
+            entries = self._buckets.get(bucket, [])
+            best_score, best_value = 0.0, None
+            for e_text, e_anchors, e_vec, e_norm, value in entries:
+                if e_text == normalized:
+                    best_score, best_value = 1.0, value
+                    break
+                if e_anchors != anchors or not e_norm:
+                    continue
+                small, large = (vec, e_vec) if len(vec) <= len(e_vec) else (e_vec, vec)
+                dot = sum(v * large.get(k, 0) for k, v in small.items())
+                score = dot / (norm * e_norm)
+                if score > best_score:
+                    best_score, best_value = score, value
+
+        if best_value is not None and best_score >= self.threshold:
+            logger.debug("semantic cache hit %s (%.3f)", bucket, best_score)
+            return best_value
+        logger.debug("semantic cache miss %s", bucket)
+        return None
+
+    def set(self, bucket: Hashable, text: str, value: Any) -> None:
+        normalized, anchors, vec, norm = self._entry(text)
+        if not normalized:
+            return
+        with self._lock:
+            entries = self._buckets.get(bucket, [])
+            entries.append((normalized, anchors, vec, norm, value))
+            # 重新赋值以刷新 TTL，并限制单桶大小
+            self._buckets[bucket] = entries[-self.max_per_bucket:]
+
+    def invalidate(self, subject: Optional[Any] = None) -> None:
+        """清空缓存"""
+        with self._lock:
+            self._buckets.clear()
@@ -5,24 +5,27 @@ Configuration file for API keys and settings
 """
 
 import os
-from typing import Optional
+from typing import NamedTuple, Optional
 
 # LLM API 配置
 # OpenAI 兼容接口配置
 # 支持 OpenAI, Azure OpenAI, 通义千问, 智谱AI, DeepSeek 等
-# API_KEY: str = os.getenv("OPENAI_API_KEY", "your-api-key-here")
-# API_BASE_URL: str = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1")
-# MODEL_NAME: str = os.getenv("MODEL_NAME", "gpt-3.5-turbo")
-
-# OpenAI配置
-API_KEY = "sk-enjuilxyOwCDla1n0dEeCc8cAf224930A9D79330F3AcEcBb"
-API_BASE_URL = "https://api.aigc369.com/v1"
-MODEL_NAME = "gpt-3.5-turbo"
+# 密钥只从环境变量读取，不要写进代码仓库；模块导入时读取一次
+API_KEY: str = os.getenv("OPENAI_API_KEY", "your-api-key-here")
+API_BASE_URL: str = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1")
+MODEL_NAME: str = os.getenv("MODEL_NAME", "gpt-3.5-turbo")
 
 # 服务器配置
 BACKEND_HOST: str = "127.0.0.1"
 BACKEND_PORT: int = 8000
 BACKEND_URL: str = f"http://{BACKEND_HOST}:{BACKEND_PORT}"
+# 后端进程数（可用环境变量 WEB_CONCURRENCY 覆盖）
+# 内存数据库按进程隔离，会话不在进程间共享；换成共享存储之前请保持为 1
+BACKEND_WORKERS: int = int(os.getenv("WEB_CONCURRENCY", "1"))
+# 允许跨域访问后端的前端地址（逗号分隔，可用环境变量 ALLOWED_ORIGINS 覆盖）
+ALLOWED_ORIGINS: list = os.getenv("ALLOWED_ORIGINS", "http://localhost:8501,http://127.0.0.1:8501").split(",")
+# uvicorn 逐请求访问日志（默认关闭，业务事件已记入系统日志；设环境变量 BACKEND_ACCESS_LOG=1 开启）
+BACKEND_ACCESS_LOG: bool = os.getenv("BACKEND_ACCESS_LOG", "0") == "1"
 
 # 系统配置
 SYSTEM_NAME: str = "AI 智能辅助学习系统"
@@ -33,11 +36,86 @@ GRADE_A_THRESHOLD: float = 0.85  # A级理解阈值
 GRADE_B_THRESHOLD: float = 0.60  # B级理解阈值
 MAX_RETRY_COUNT: int = 3  # 最大重试次数
 
+# LLM 客户端配置
+LLM_TEMPERATURE: float = 0.7  # 默认生成温度
+LLM_TIMEOUT: float = 60.0  # 请求超时（秒）
+LLM_MAX_CONNECTIONS: int = 64  # 连接池最大连接数
+LLM_MAX_KEEPALIVE_CONNECTIONS: int = 32  # 连接池最大保活连接数
+LLM_HTTP2: bool = True  # 安装了 h2 时启用 HTTP/2 多路复用
+
+# 各类调用的输出 token 上限（系统提示要求回复不超过 300 字）
+LLM_MAX_TOKENS: dict = {
+    "teach": 600,
+    "hint": 400,
+    "evaluate": 500,  # JSON 含反馈、解释、建议三段中文，过低会截断 JSON
+    "remediation": 700,
+    "summary": 400
+}
+# 评估输出 JSON 后连续空行即停止
+EVAL_STOP: list = ["\n\n\n"]
+
+# LLM 响应缓存配置
+LLM_CACHE_SIZE: int = 4096  # 缓存条目上限
+LLM_CACHE_TTL: int = 3600  # 缓存有效期（秒）
+LLM_CACHEABLE_TEMPERATURE: float = 0.2  # 温度不高于该值时默认缓存
+
+# 评估时要求模型以 JSON 对象输出（response_format=json_object），接口不支持时关闭
+EVAL_JSON_MODE: bool = True
+
+# 评估结果近似缓存配置
+SEMANTIC_CACHE_SIZE: int = 2048  # 缓存桶（题目）上限
+SEMANTIC_CACHE_TTL: int = 24 * 3600  # 缓存有效期（秒）
+SEMANTIC_CACHE_THRESHOLD: float = 0.92  # 相似度阈值
+SEMANTIC_CACHE_MAX_TEMPERATURE: float = 0.3  # 仅对不高于该温度的 Agent 启用
+
+# 教学对话历史配置
+HISTORY_KEEP_RECENT: int = 10  # 摘要后保留的原文消息条数
+HISTORY_SUMMARIZE_EVERY: int = 6  # 未摘要消息超出保留条数达到该值时折叠一次
+HISTORY_MAX_CHARS: int = 1500  # 单条历史消息最大字符数
+HISTORY_SUMMARY_MAX_CHARS: int = 300  # 摘要最大字符数（约 200 tokens）
+
+# 会话内存中保留的最大消息条数
+SESSION_MAX_MESSAGES: int = 200
+
+# 内存中保留的系统日志条数，超出后丢弃最旧的
+LOG_MAX_ENTRIES: int = 10000
+
+# 当前题目缓存配置（题目 id 持久化在会话上，缓存过期后回源）
+CURRENT_QUESTION_CACHE_SIZE: int = 10000
+CURRENT_QUESTION_CACHE_TTL: int = 3600  # 秒
+
+# 抽题随机种子（None 表示每次启动随机；调试或回放时可固定）
+QUESTION_RANDOM_SEED: Optional[int] = None
+
+# 出题后是否在后台预取提示（会额外消耗一次 LLM 调用）
+PREFETCH_HINTS: bool = True
+HINT_PREFETCH_TTL: int = 600  # 预取结果保留时间（秒），超时后按需重新生成
+
+# 连错两次后再作答时补救内容的预取方式：
+# "combined" 与评估合并为一次调用；"speculative" 与评估并发调用，答对则取消；"off" 答错后再单独生成
+REMEDIATION_PREFETCH: str = "combined"
+
+# 学科展示信息（前后端共用的静态数据）
+class SubjectInfo(NamedTuple):
+    id: str
+    name: str
+    icon: str
+    color: str
+    desc: str
+
+SUBJECTS: tuple = (
+    SubjectInfo("chinese", "语文", "📖", "#ef4444", "阅读理解、写作技巧、古诗词鉴赏"),
+    SubjectInfo("math", "数学", "📐", "#3b82f6", "代数方程、函数图像、几何证明"),
+    SubjectInfo("english", "英语", "🌍", "#22c55e", "语法时态、阅读写作、口语表达"),
+    SubjectInfo("history", "历史", "🏛️", "#f59e0b", "中国历史、世界历史、历史分析"),
+    SubjectInfo("politics", "政治", "⚖️", "#8b5cf6", "政治理论、经济常识、时事分析"),
+)
+
 # 验证配置
 def validate_config() -> bool:
     """验证配置是否有效"""
     if API_KEY == "your-api-key-here" or not API_KEY:
-        print("⚠️ 警告: 请在 config.py 中配置您的 API_KEY")
+        print("⚠️ 警告: 请设置环境变量 OPENAI_API_KEY")
         return False
     return True
 
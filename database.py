@@ -4,24 +4,51 @@ AI 智能学习操作系统 - 数据库模块
 In-memory database with preset content
 """
 
-from typing import Dict, List, Optional, Any
+from collections import deque
+from itertools import islice, takewhile
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Any, Tuple
 from datetime import datetime
+from config import LOG_MAX_ENTRIES
 from models import (
     Question, KnowledgeItem, Session, StudentProgress,
     Subject, QuestionType, GradeLevel, SessionState, SystemLog
 )
-import uuid
 
 class Database:
     """内存数据库"""
 
+    # 建二级索引的字段；列表字段（如 tags）按每个元素分别建索引
+    QUESTION_INDEX_FIELDS = ("subject", "topic_id", "difficulty", "question_type", "is_transfer")
+    KNOWLEDGE_INDEX_FIELDS = ("subject", "topic_id", "tags")
+
     def __init__(self):
         self.questions: Dict[str, Question] = {}
         self.knowledge: Dict[str, KnowledgeItem] = {}
         self.sessions: Dict[str, Session] = {}
+        # 学生 -> 会话数，随会话增删维护，活跃学生数直接取其长度
+        self._student_session_count: Dict[str, int] = {}
         self.progress: Dict[str, StudentProgress] = {}
-        self.logs: List[SystemLog] = []
+        # 日志按时间顺序追加，定长环形缓冲
+        self.logs: Deque[SystemLog] = deque(maxlen=LOG_MAX_ENTRIES)
         self.ai_interactions: int = 0
+        # LLM 输入 token 统计：总数与命中服务端前缀缓存的部分
+        self.prompt_tokens: int = 0
+        self.cached_prompt_tokens: int = 0
+        # 知识库版本号：任何知识点写操作都会递增，用于下游缓存失效
+        self.knowledge_version: int = 0
+        # 题库版本号：任何题目写操作都会递增，用于下游缓存失效
+        self.questions_version: int = 0
+        # 日志版本号：每写一条日志递增（日志条数可能被截断，不能用长度代替）
+        self.logs_version: int = 0
+        # 知识库变更回调（参数为变更的学科），由上层缓存注册
+        self._knowledge_listeners: List[Callable[[Subject], None]] = []
+        # 二级索引：字段 -> 取值 -> id 集合（用 dict 保持插入顺序），随写操作同步维护
+        self._question_index: Dict[str, Dict[Any, Dict[str, None]]] = {f: {} for f in self.QUESTION_INDEX_FIELDS}
+        self._knowledge_index: Dict[str, Dict[Any, Dict[str, None]]] = {f: {} for f in self.KNOWLEDGE_INDEX_FIELDS}
+        # 学科统计缓存：(知识库版本, 题库版本) -> 统计结果，版本不变时直接复用
+        self._subject_stats_cache: Optional[Tuple[Tuple[int, int], Dict[str, Dict[str, int]]]] = None
+        # 主题列表缓存：(知识库版本, 学科 -> 主题列表)，版本变化后首次访问时整体重建
+        self._topics_cache: Optional[Tuple[int, Dict[str, List[Dict[str, str]]]]] = None
         
         # 初始化预置数据
         self._init_preset_data()
@@ -438,52 +465,174 @@ class Database:
     
     def _add_knowledge(self, item: KnowledgeItem):
         """添加知识点"""
-        self.knowledge[item.id] = item
+        self._put_knowledge(item)
+        self.knowledge_version += 1
     
     def _add_question(self, q: Question):
         """添加题目"""
-        self.questions[q.id] = q
+        self._put_question(q)
+        self.questions_version += 1
     
-    def _add_log(self, log_type: str, message: str, details: dict = None):
+    def _add_log(self, log_type: str, message: str, details: Optional[dict] = None):
         """添加日志"""
-        self.logs.append(SystemLog(
+        # 空 details 统一存 None，不为每条日志保留一个空 dict
+        details = details or None
+        self.logs_version += 1
+        # 字段均由服务端生成，跳过校验直接构造；缓冲已满时 deque 自动挤出最旧条目。
+        # 每条日志都是新对象，已交给调用方的条目不会被改写
+        entry = SystemLog.model_construct(
             log_type=log_type,
             message=message,
-            details=details
-        ))
+            details=details,
+            seq=self.logs_version
+        )
+        self.logs.append(entry)
+
+    # 二级索引
+
+    @staticmethod
+    def _index_values(item: Any, field: str) -> List[Any]:
+        value = getattr(item, field)
+        return value if isinstance(value, list) else [value]
+
+    def _index_add(self, index: Dict[str, Dict[Any, Dict[str, None]]], item: Any):
+        for field, buckets in index.items():
+            for value in self._index_values(item, field):
+                buckets.setdefault(value, {})[item.id] = None
+
+    def _index_remove(self, index: Dict[str, Dict[Any, Dict[str, None]]], item: Any):
+        for field, buckets in index.items():
+            for value in self._index_values(item, field):
+                bucket = buckets.get(value)
+                if bucket is not None:
+                    bucket.pop(item.id, None)
+                    if not bucket:
+                        del buckets[value]
+
+    def _index_iter(self, index: Dict[str, Dict[Any, Dict[str, None]]], store: Dict[str, Any], **filters: Any) -> Iterator[Any]:
+        """按多个字段等值过滤：从最小的桶出发检查其余桶，空值的条件忽略；惰性产出，迭代期间不可写库"""
+        buckets = [index[field].get(value, {}) for field, value in filters.items() if value]
+        if not buckets:
+            return iter(store.values())
+        buckets.sort(key=len)
+        smallest, others = buckets[0], buckets[1:]
+        return (store[i] for i in smallest if all(i in b for b in others))
+
+    def _index_query(self, index: Dict[str, Dict[Any, Dict[str, None]]], store: Dict[str, Any], **filters: Any) -> List[Any]:
+        return list(self._index_iter(index, store, **filters))
+
+    def _put_session(self, session: Session):
+        old = self.sessions.get(session.id)
+        if old is not None:
+            self._release_student(old.student_id)
+        self.sessions[session.id] = session
+        self._student_session_count[session.student_id] = self._student_session_count.get(session.student_id, 0) + 1
+
+    def _release_student(self, student_id: str):
+        remaining = self._student_session_count.get(student_id, 0) - 1
+        if remaining > 0:
+            self._student_session_count[student_id] = remaining
+        else:
+            self._student_session_count.pop(student_id, None)
+
+    def _put_question(self, q: Question):
+        old = self.questions.get(q.id)
+        if old is not None:
+            self._index_remove(self._question_index, old)
+        self.questions[q.id] = q
+        self._index_add(self._question_index, q)
+
+    def _put_knowledge(self, k: KnowledgeItem):
+        old = self.knowledge.get(k.id)
+        if old is not None:
+            self._index_remove(self._knowledge_index, old)
+        self.knowledge[k.id] = k
+        self._index_add(self._knowledge_index, k)
 
     # 查询方法
+
+    def query_questions(
+        self,
+        subject: Optional[Subject] = None,
+        topic_id: Optional[str] = None,
+        difficulty: Optional[int] = None,
+        question_type: Optional[QuestionType] = None
+    ) -> List[Question]:
+        """按条件筛选题目（走二级索引）"""
+        return self._index_query(
+            self._question_index, self.questions,
+            subject=subject, topic_id=topic_id, difficulty=difficulty, question_type=question_type
+        )
+
+    def iter_questions(
+        self,
+        subject: Optional[Subject] = None,
+        topic_id: Optional[str] = None,
+        difficulty: Optional[int] = None,
+        question_type: Optional[QuestionType] = None
+    ) -> Iterator[Question]:
+        """query_questions 的惰性版本，只需遍历一次的只读调用方用它省去中间列表"""
+        return self._index_iter(
+            self._question_index, self.questions,
+            subject=subject, topic_id=topic_id, difficulty=difficulty, question_type=question_type
+        )
+
+    def iter_knowledge(
+        self,
+        subject: Optional[Subject] = None,
+        topic_id: Optional[str] = None,
+        tag: Optional[str] = None
+    ) -> Iterator[KnowledgeItem]:
+        """query_knowledge 的惰性版本"""
+        return self._index_iter(self._knowledge_index, self.knowledge, subject=subject, topic_id=topic_id, tags=tag)
+
+    def query_knowledge(
+        self,
+        subject: Optional[Subject] = None,
+        topic_id: Optional[str] = None,
+        tag: Optional[str] = None
+    ) -> List[KnowledgeItem]:
+        """按条件筛选知识点（走二级索引）"""
+        return self._index_query(self._knowledge_index, self.knowledge, subject=subject, topic_id=topic_id, tags=tag)
     
+    def get_question(self, question_id: str) -> Optional[Question]:
+        """获取题目"""
+        return self.questions.get(question_id)
+
     def get_questions_by_subject(self, subject: Subject) -> List[Question]:
         """获取某学科的所有题目"""
-        return [q for q in self.questions.values() if q.subject == subject]
+        return self.query_questions(subject=subject)
     
     def get_questions_by_topic(self, subject: Subject, topic_id: str) -> List[Question]:
         """获取某主题的所有题目"""
-        return [q for q in self.questions.values() 
-                if q.subject == subject and q.topic_id == topic_id]
+        return self.query_questions(subject=subject, topic_id=topic_id)
     
     def get_transfer_questions(self, subject: Subject, topic_id: str) -> List[Question]:
         """获取迁移测试题目"""
-        return [q for q in self.questions.values() 
-                if q.subject == subject and q.topic_id == topic_id and q.is_transfer]
+        return self._index_query(
+            self._question_index, self.questions, subject=subject, topic_id=topic_id, is_transfer=True
+        )
     
     def get_knowledge_by_subject(self, subject: Subject) -> List[KnowledgeItem]:
         """获取某学科的所有知识点"""
-        return [k for k in self.knowledge.values() if k.subject == subject]
+        return self.query_knowledge(subject=subject)
     
     def get_knowledge_by_topic(self, subject: Subject, topic_id: str) -> List[KnowledgeItem]:
         """获取某主题的知识点"""
-        return [k for k in self.knowledge.values() 
-                if k.subject == subject and k.topic_id == topic_id]
+        return self.query_knowledge(subject=subject, topic_id=topic_id)
     
     def get_topics_by_subject(self, subject: Subject) -> List[Dict[str, str]]:
-        """获取某学科的所有主题"""
-        topics = {}
-        for k in self.knowledge.values():
-            if k.subject == subject:
-                topics[k.topic_id] = k.topic_name
-        return [{"id": tid, "name": tname} for tid, tname in topics.items()]
+        """获取某学科的所有主题（按知识库版本缓存）"""
+        if self._topics_cache is None or self._topics_cache[0] != self.knowledge_version:
+            grouped: Dict[str, Dict[str, str]] = {}
+            for k in self.knowledge.values():
+                grouped.setdefault(k.subject, {})[k.topic_id] = k.topic_name
+            topics_map = {
+                subj: [{"id": tid, "name": tname} for tid, tname in topics.items()]
+                for subj, topics in grouped.items()
+            }
+            self._topics_cache = (self.knowledge_version, topics_map)
+        return self._topics_cache[1].get(subject, [])
     
     def get_session(self, session_id: str) -> Optional[Session]:
         """获取会话"""
@@ -495,82 +644,152 @@ class Database:
             student_id=student_id,
             subject=subject
         )
-        self.sessions[session.id] = session
+        self._put_session(session)
         return session
     
     def update_session(self, session: Session):
         """更新会话"""
         session.updated_at = datetime.now()
-        self.sessions[session.id] = session
+        self._put_session(session)
+
+    def delete_session(self, session_id: str) -> bool:
+        """删除会话"""
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return False
+        self._release_student(session.student_id)
+        return True
+
+    def append_messages(self, session: Session, messages: List[Dict[str, str]]):
+        """追加会话消息（只写本轮增量，不重写整个会话）"""
+        for msg in messages:
+            session.add_message(msg["role"], msg["content"])
+        session.updated_at = datetime.now()
+        if session.id not in self.sessions:
+            self._put_session(session)
+
+    def update_session_scalars(self, session: Session, **fields: Any):
+        """只更新会话的标量字段（状态、等级等）"""
+        for name, value in fields.items():
+            setattr(session, name, value)
+        session.updated_at = datetime.now()
+        if session.id not in self.sessions:
+            self._put_session(session)
     
-    def get_stats(self) -> Dict[str, Any]:
-        """获取统计数据"""
+    def get_subject_stats(self) -> Dict[str, Dict[str, int]]:
+        """各学科题目/知识点/主题数量；按版本号缓存，题库与知识库未变更时不重新聚合"""
+        versions = (self.knowledge_version, self.questions_version)
+        if self._subject_stats_cache is not None and self._subject_stats_cache[0] == versions:
+            return self._subject_stats_cache[1]
+
         subject_stats = {}
         for subj in Subject:
-            questions = self.get_questions_by_subject(subj)
-            knowledge = self.get_knowledge_by_subject(subj)
             subject_stats[subj.value] = {
-                "questions": len(questions),
-                "knowledge": len(knowledge),
+                # 计数直接取学科索引桶的大小，不物化列表
+                "questions": len(self._question_index["subject"].get(subj, ())),
+                "knowledge": len(self._knowledge_index["subject"].get(subj, ())),
                 "topics": len(self.get_topics_by_subject(subj))
             }
+        self._subject_stats_cache = (versions, subject_stats)
+        return subject_stats
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取统计数据"""
+        subject_stats = self.get_subject_stats()
         
         return {
-            "active_students": len(set(s.student_id for s in self.sessions.values())),
+            "active_students": len(self._student_session_count),
             "knowledge_count": len(self.knowledge),
             "question_count": len(self.questions),
             "ai_interactions": self.ai_interactions,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_prompt_tokens": self.cached_prompt_tokens,
             "average_mastery": 0.65,  # 模拟数据
             "subject_stats": subject_stats
         }
     
+    def add_knowledge_listener(self, callback: Callable[[Subject], None]):
+        """注册知识库变更回调"""
+        self._knowledge_listeners.append(callback)
+
+    def _notify_knowledge_changed(self, subject: Subject):
+        """通知知识库变更"""
+        for callback in self._knowledge_listeners:
+            callback(subject)
+
     def increment_interactions(self):
         """增加交互次数"""
         self.ai_interactions += 1
+
+    def add_log(self, log_type: str, message: str, details: Optional[dict] = None):
+        """记录系统日志（对外接口）"""
+        self._add_log(log_type, message, details)
+    
+    def record_prompt_usage(self, input_tokens: int, cached_tokens: int):
+        """记录输入 token 用量"""
+        self.prompt_tokens += input_tokens
+        self.cached_prompt_tokens += cached_tokens
     
     def add_question(self, q: Question) -> Question:
         """添加题目（对外接口）"""
-        self.questions[q.id] = q
+        self._put_question(q)
+        self.questions_version += 1
         self._add_log("success", f"添加题目: {q.content[:30]}...", {"subject": q.subject, "type": q.question_type})
         return q
     
     def update_question(self, q: Question) -> Question:
         """更新题目"""
-        self.questions[q.id] = q
+        self._put_question(q)
+        self.questions_version += 1
         self._add_log("info", f"更新题目: {q.id}")
         return q
     
     def delete_question(self, question_id: str) -> bool:
         """删除题目"""
-        if question_id in self.questions:
-            del self.questions[question_id]
-            self._add_log("warning", f"删除题目: {question_id}")
-            return True
-        return False
+        q = self.questions.pop(question_id, None)
+        if q is None:
+            return False
+        self._index_remove(self._question_index, q)
+        self.questions_version += 1
+        self._add_log("warning", f"删除题目: {question_id}")
+        return True
     
     def add_knowledge(self, k: KnowledgeItem) -> KnowledgeItem:
         """添加知识点（对外接口）"""
-        self.knowledge[k.id] = k
+        self._put_knowledge(k)
+        self.knowledge_version += 1
         self._add_log("success", f"添加知识点: {k.title}", {"subject": k.subject})
+        self._notify_knowledge_changed(k.subject)
         return k
     
     def update_knowledge(self, k: KnowledgeItem) -> KnowledgeItem:
         """更新知识点"""
-        self.knowledge[k.id] = k
+        self._put_knowledge(k)
+        self.knowledge_version += 1
         self._add_log("info", f"更新知识点: {k.id}")
+        self._notify_knowledge_changed(k.subject)
         return k
     
     def delete_knowledge(self, knowledge_id: str) -> bool:
         """删除知识点"""
-        if knowledge_id in self.knowledge:
-            del self.knowledge[knowledge_id]
-            self._add_log("warning", f"删除知识点: {knowledge_id}")
-            return True
-        return False
+        item = self.knowledge.pop(knowledge_id, None)
+        if item is None:
+            return False
+        self._index_remove(self._knowledge_index, item)
+        self.knowledge_version += 1
+        self._add_log("warning", f"删除知识点: {knowledge_id}")
+        self._notify_knowledge_changed(item.subject)
+        return True
     
-    def get_recent_logs(self, limit: int = 20) -> List[SystemLog]:
-        """获取最近的日志"""
-        return sorted(self.logs, key=lambda x: x.timestamp, reverse=True)[:limit]
+    def get_recent_logs(self, limit: int = 20, offset: int = 0, since: Optional[int] = None) -> List[SystemLog]:
+        """获取最近的日志（追加顺序即时间顺序，倒序跳过 offset 条后取 limit 条）
+
+        传入 since 时只返回序号大于 since 的新日志，遇到旧日志即停止，代价与新增条数成正比。
+        """
+        logs = reversed(self.logs)
+        if since is not None:
+            logs = takewhile(lambda log: log.seq > since, logs)
+        return list(islice(logs, offset, offset + limit))
 
 # 全局数据库实例
 db = Database()
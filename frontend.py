@@ -4,12 +4,20 @@ AI 智能学习操作系统 - Streamlit 前端
 Frontend UI with student and admin modes
 """
 
+import json
+import re
 import streamlit as st
 import requests
-import time
-from datetime import datetime
-from typing import Optional, List, Dict, Any
-from config import BACKEND_URL, SYSTEM_NAME, SYSTEM_VERSION, validate_config
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Optional, Dict, Any, Iterator, List, Tuple
+from urllib.parse import urlencode
+from config import BACKEND_URL, SUBJECTS, SYSTEM_NAME, SYSTEM_VERSION
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # 页面配置
 st.set_page_config(
@@ -19,9 +27,64 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# 自定义 CSS 样式
-def load_custom_css():
-    st.markdown("""
+# 静态展示数据（模块级常量，不随每次 rerun 重建；学科信息与后端共用 config.SUBJECTS）
+_SUBJECT_IDS: Tuple[str, ...] = tuple(s.id for s in SUBJECTS)
+_SUBJECT_CARDS_HTML = '<div class="subject-grid">' + "".join(
+    f'<div class="subject-card"><div class="subject-icon">{s.icon}</div>'
+    f'<div class="subject-name">{s.name}</div><div class="subject-desc">{s.desc}</div></div>'
+    for s in SUBJECTS
+) + "</div>"
+_SUBJECT_NAMES: Dict[str, str] = {s.id: s.name for s in SUBJECTS}
+_SUBJECT_LABELS: Dict[str, str] = {s.id: f"{s.icon} {s.name}" for s in SUBJECTS}
+_SUBJECT_FILTER_OPTIONS: Tuple[str, ...] = ("全部", *_SUBJECT_IDS)
+_SUBJECT_FILTER_NAMES: Dict[str, str] = {"全部": "全部", **_SUBJECT_NAMES}
+
+# 管理端下拉框选项及显示名（format_func 直接用绑定的 dict.get）
+_QUESTION_TYPE_NAMES: Dict[str, str] = {
+    "choice": "选择题", "judgment": "判断题", "qa": "问答题", "fill": "填空题", "application": "应用题"
+}
+_QUESTION_TYPES: Tuple[str, ...] = tuple(_QUESTION_TYPE_NAMES)
+_QUESTION_TYPE_FILTER_OPTIONS: Tuple[str, ...] = ("全部", *_QUESTION_TYPES)
+_QUESTION_TYPE_FILTER_NAMES: Dict[str, str] = {"全部": "全部", **_QUESTION_TYPE_NAMES}
+_SOURCE_TYPE_NAMES: Dict[str, str] = {"text": "文本", "pdf": "PDF", "link": "链接"}
+_SOURCE_TYPES: Tuple[str, ...] = tuple(_SOURCE_TYPE_NAMES)
+
+# 管理端列表每页条数
+PAGE_SIZE = 20
+# 对话区直接展开的最近消息条数
+CHAT_WINDOW = 20
+
+_LEARNING_TIPS: Dict[str, Tuple[str, ...]] = {
+    "chinese": ("多读多写是提高语文的关键", "理解文章要先了解作者背景"),
+    "math": ("先理解概念再做题", "画图可以帮助理解几何问题"),
+    "english": ("每天背诵10个单词", "多听英语培养语感"),
+    "history": ("用时间线梳理历史事件", "理解历史要看因果关系"),
+    "politics": ("结合时事理解理论", "注意概念之间的联系"),
+}
+_COMMON_MISTAKES: Dict[str, Tuple[str, ...]] = {
+    "chinese": ("混淆比喻和拟人",),
+    "math": ("公式符号使用错误",),
+    "english": ("时态使用混乱",),
+    "history": ("时间点记忆混淆",),
+    "politics": ("概念理解表面化",),
+}
+
+# 对话区快捷操作：(按钮文字, 发送的消息)
+_QUICK_ACTIONS: Tuple[Tuple[str, str], ...] = (
+    ("📝 开始练习", "我想做一些练习题"),
+    ("💡 给我提示", "给我一些提示"),
+    ("📖 知识总结", "请帮我总结一下今天学习的内容"),
+)
+
+def _minify_css(css: str) -> str:
+    """去掉注释和多余空白，减少每次 rerun 推送给浏览器的字节数"""
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    return re.sub(r"\s*([{};,])\s*", r"\1", css).strip()
+
+
+# 自定义 CSS 样式（纯静态，模块级常量只构建一次）
+_CUSTOM_CSS = _minify_css("""
     <style>
     /* 全局样式 */
     .main {
@@ -72,7 +135,6 @@ def load_custom_css():
         text-align: center;
         box-shadow: 0 4px 15px rgba(0, 0, 0, 0.1);
         transition: all 0.3s ease;
-        cursor: pointer;
         margin: 0.5rem;
     }
 
@@ -81,6 +143,18 @@ def load_custom_css():
         box-shadow: 0 8px 25px rgba(0, 0, 0, 0.15);
     }
 
+    .subject-grid {
+        display: grid;
+        grid-template-columns: repeat(5, 1fr);
+        gap: 0.5rem;
+    }
+
+    .subject-desc {
+        color: #666;
+        font-size: 0.8rem;
+        margin-top: 0.5rem;
+    }
+
     .subject-icon {
         font-size: 3rem;
         margin-bottom: 0.5rem;
@@ -171,6 +245,23 @@ def load_custom_css():
         box-shadow: 0 2px 10px rgba(0, 0, 0, 0.05);
     }
 
+    /* 侧边栏提示/误区（配色同 st.info / st.warning） */
+    .sidebar-tip, .sidebar-mistake {
+        border-radius: 0.5rem;
+        padding: 0.75rem 1rem;
+        margin-bottom: 0.75rem;
+    }
+
+    .sidebar-tip {
+        background: rgba(28, 131, 225, 0.1);
+        color: #0054a3;
+    }
+
+    .sidebar-mistake {
+        background: rgba(255, 227, 18, 0.1);
+        color: #926c05;
+    }
+
     /* 进度条 */
     .progress-bar {
         background: #e0e0e0;
@@ -191,36 +282,137 @@ def load_custom_css():
     footer {visibility: visible;}
     header {visibility: visible;}
     </style>
-    """, unsafe_allow_html=True)
+""")
+
+
+def load_custom_css():
+    st.markdown(_CUSTOM_CSS, unsafe_allow_html=True)
 
 # API 调用函数
 
+# (连接超时, 读取超时)：后端不可达时 2 秒内失败，而不是等满整个读取超时
+_TIMEOUT = (2, 10)
+_CHAT_TIMEOUT = (2, 30)   # 非流式对话需等待 LLM 完整生成
+_STREAM_TIMEOUT = (2, 60)  # 流式对话：两段数据之间的最长间隔
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+def _loads(content: bytes) -> Any:
+    """解析响应体；orjson 可用时走 C 实现，题目/知识列表这类大数组快数倍"""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def _dumps(data: Any) -> bytes:
+    """序列化请求体"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+@st.cache_resource(show_spinner=False)
+def _http_session() -> requests.Session:
+    """跨 rerun 共用的 HTTP 会话，复用到后端的 keep-alive 连接"""
+    session = requests.Session()
+    # 只对幂等请求在网关错误时重试（urllib3 默认不重试 POST）
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504])
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
 def api_get(endpoint: str) -> Optional[Dict]:
     """GET 请求"""
     try:
-        response = requests.get(f"{BACKEND_URL}{endpoint}", timeout=10)
+        response = _http_session().get(f"{BACKEND_URL}{endpoint}", timeout=_TIMEOUT)
         response.raise_for_status()
-        return response.json()
+        return _loads(response.content)
+    except Exception as e:
+        st.error(f"API 请求失败: {e}")
+        return None
+
+@st.cache_resource(show_spinner=False)
+def _validators() -> Dict[str, Tuple[str, Any, Optional[int]]]:
+    """按 URL 记录上次响应的 (ETag, JSON, X-Total-Count)，跨 rerun 共用"""
+    return {}
+
+@st.cache_data(ttl=15, show_spinner=False)
+def _cached_get(endpoint: str) -> Tuple[Any, Optional[int]]:
+    """返回 (响应 JSON, X-Total-Count)
+
+    缓存过期后带上次的 ETag 发条件请求，数据未变时后端回 304，直接复用上次的结果。
+    """
+    url = f"{BACKEND_URL}{endpoint}"
+    validators = _validators()
+    previous = validators.get(url)
+    headers = {"If-None-Match": previous[0]} if previous else None
+    response = _http_session().get(url, headers=headers, timeout=_TIMEOUT)
+    if response.status_code == 304 and previous:
+        return previous[1], previous[2]
+    response.raise_for_status()
+    total = response.headers.get("X-Total-Count")
+    result = (_loads(response.content), int(total) if total is not None else None)
+    etag = response.headers.get("ETag")
+    if etag:
+        if len(validators) >= 256:
+            validators.clear()
+        validators[url] = (etag, *result)
+    return result
+
+def api_get_cached(endpoint: str) -> Optional[Dict]:
+    """只读 GET，15 秒内重复请求直接取缓存；失败不缓存"""
+    try:
+        return _cached_get(endpoint)[0]
     except Exception as e:
         st.error(f"API 请求失败: {e}")
         return None
 
+def api_get_page(path: str, page: int, filters: Optional[Dict[str, str]] = None,
+                 page_size: int = PAGE_SIZE) -> Tuple[List[Dict], int]:
+    """分页读取列表接口（走同一份缓存），返回 (本页数据, 总条数)
+
+    filters 中值为"全部"的项不作为查询参数；参数顺序固定，相同筛选条件得到相同缓存键。
+    """
+    query = {k: v for k, v in (filters or {}).items() if v != "全部"}
+    query.update(limit=page_size, offset=(page - 1) * page_size)
+    try:
+        items, total = _cached_get(f"{path}?{urlencode(query)}")
+    except Exception as e:
+        st.error(f"API 请求失败: {e}")
+        return [], 0
+    return items, total if total is not None else len(items)
+
 def api_post(endpoint: str, data: Dict) -> Optional[Dict]:
     """POST 请求"""
     try:
-        response = requests.post(f"{BACKEND_URL}{endpoint}", json=data, timeout=30)
+        response = _http_session().post(f"{BACKEND_URL}{endpoint}", data=_dumps(data),
+                                          headers=_JSON_HEADERS, timeout=_CHAT_TIMEOUT)
         response.raise_for_status()
-        return response.json()
+        return _loads(response.content)
     except Exception as e:
         st.error(f"API 请求失败: {e}")
         return None
 
+def api_post_stream(endpoint: str, data: Dict) -> Iterator[Dict]:
+    """POST 并逐条产出 SSE 事件（data: {json}）"""
+    with _http_session().post(f"{BACKEND_URL}{endpoint}", data=_dumps(data), headers=_JSON_HEADERS,
+                              stream=True, timeout=_STREAM_TIMEOUT) as response:
+        response.raise_for_status()
+        for line in response.iter_lines(decode_unicode=True):
+            if line and line.startswith("data:"):
+                yield _loads(line[5:])
+
 def api_put(endpoint: str, data: Dict) -> Optional[Dict]:
     """PUT 请求"""
     try:
-        response = requests.put(f"{BACKEND_URL}{endpoint}", json=data, timeout=10)
+        response = _http_session().put(f"{BACKEND_URL}{endpoint}", data=_dumps(data),
+                                         headers=_JSON_HEADERS, timeout=_TIMEOUT)
         response.raise_for_status()
-        return response.json()
+        return _loads(response.content)
     except Exception as e:
         st.error(f"API 请求失败: {e}")
         return None
@@ -228,7 +420,7 @@ def api_put(endpoint: str, data: Dict) -> Optional[Dict]:
 def api_delete(endpoint: str) -> bool:
     """DELETE 请求"""
     try:
-        response = requests.delete(f"{BACKEND_URL}{endpoint}", timeout=10)
+        response = _http_session().delete(f"{BACKEND_URL}{endpoint}", timeout=_TIMEOUT)
         response.raise_for_status()
         return True
     except Exception as e:
@@ -252,35 +444,50 @@ def init_session_state():
         st.session_state.mastery_level = 0
 
 # 页面头部
-def render_header():
-    """渲染页面头部"""
-    st.markdown(f"""
+@st.cache_data(show_spinner=False)
+def _header_html(system_name: str, system_version: str) -> str:
+    """页头 HTML，每次 rerun 复用同一字符串"""
+    return f"""
     <div class="fade-in" style="text-align: center; padding: 1rem;">
-        <h1 class="main-title">🎓 {SYSTEM_NAME}</h1>
-        <p class="subtitle">{SYSTEM_VERSION} | 智能学习，因材施教</p>
+        <h1 class="main-title">🎓 {system_name}</h1>
+        <p class="subtitle">{system_version} | 智能学习，因材施教</p>
     </div>
-    """, unsafe_allow_html=True)
+    """
+
+
+def render_header():
+    """渲染页面头部"""
+    st.markdown(_header_html(SYSTEM_NAME, SYSTEM_VERSION), unsafe_allow_html=True)
 
     # 模式切换
     col1, col2, col3 = st.columns([1, 2, 1])
     with col2:
         mode_cols = st.columns(2)
+        # 状态在 on_click 回调里改写，点击触发的那次 rerun 直接按新状态渲染
         with mode_cols[0]:
-            if st.button("👨‍🎓 学生端", use_container_width=True,
-                         type="primary" if st.session_state.mode == "student" else "secondary"):
-                st.session_state.mode = "student"
-                st.session_state.current_subject = None
-                st.session_state.session_id = None
-                st.session_state.messages = []
-                st.rerun()
+            st.button("👨‍🎓 学生端", use_container_width=True,
+                      type="primary" if st.session_state.mode == "student" else "secondary",
+                      on_click=_switch_mode, args=("student",))
         with mode_cols[1]:
-            if st.button("👨‍💼 管理端", use_container_width=True,
-                         type="primary" if st.session_state.mode == "admin" else "secondary"):
-                st.session_state.mode = "admin"
-                st.rerun()
+            st.button("👨‍💼 管理端", use_container_width=True,
+                      type="primary" if st.session_state.mode == "admin" else "secondary",
+                      on_click=_switch_mode, args=("admin",))
 
     st.markdown("---")
 
+def _switch_mode(mode: str):
+    """切换学生端/管理端；切到学生端时回到科目选择"""
+    st.session_state.mode = mode
+    if mode == "student":
+        _leave_subject()
+
+
+def _leave_subject():
+    """结束当前科目会话，回到科目选择"""
+    st.session_state.current_subject = None
+    st.session_state.session_id = None
+    st.session_state.messages = []
+
 # 学生端 - 学科选择
 def render_subject_selection():
     """渲染学科选择页面"""
@@ -289,42 +496,28 @@ def render_subject_selection():
     st.markdown("点击下方卡片，开始你的智能学习之旅")
     st.markdown("")
 
-    subjects = [
-        {"id": "chinese", "name": "语文", "icon": "📖", "desc": "阅读理解、写作技巧、古诗词鉴赏"},
-        {"id": "math", "name": "数学", "icon": "📐", "desc": "代数方程、函数图像、几何证明"},
-        {"id": "english", "name": "英语", "icon": "🌍", "desc": "语法时态、阅读写作、口语表达"},
-        {"id": "history", "name": "历史", "icon": "🏛️", "desc": "中国历史、世界历史、历史分析"},
-        {"id": "politics", "name": "政治", "icon": "⚖️", "desc": "政治理论、经济常识、时事分析"},
-    ]
-
-    cols = st.columns(5)
-    for i, subj in enumerate(subjects):
-        with cols[i]:
-            with st.container():
-                st.markdown(f"""
-                <div style="text-align: center; padding: 1rem;">
-                    <div style="font-size: 3rem;">{subj['icon']}</div>
-                    <div style="font-weight: bold; font-size: 1.2rem; margin: 0.5rem 0;">{subj['name']}</div>
-                    <div style="color: #666; font-size: 0.8rem;">{subj['desc']}</div>
-                </div>
-                """, unsafe_allow_html=True)
-
-                if st.button(f"开始学习", key=f"subj_{subj['id']}", use_container_width=True):
-                    # 创建会话
-                    result = api_post("/api/sessions", {
-                        "student_id": "streamlit_user",
-                        "subject": subj['id']
-                    })
-                    if result:
-                        st.session_state.current_subject = subj['id']
-                        st.session_state.session_id = result['session_id']
-                        st.session_state.messages = [
-                            {"role": "assistant", "content": result['welcome_message']}
-                        ]
-                        st.rerun()
+    # 卡片是纯展示，整块 HTML 一次输出；下方一行按钮负责创建会话
+    st.markdown(_SUBJECT_CARDS_HTML, unsafe_allow_html=True)
+    for col, subj in zip(st.columns(len(SUBJECTS)), SUBJECTS):
+        col.button("开始学习", key=f"subj_{subj.id}", use_container_width=True,
+                   on_click=_start_session, args=(subj.id,))
 
     st.markdown('</div>', unsafe_allow_html=True)
 
+
+def _start_session(subject: str):
+    """创建学习会话并进入对话界面"""
+    result = api_post("/api/sessions", {
+        "student_id": "streamlit_user",
+        "subject": subject
+    })
+    if result:
+        st.session_state.current_subject = subject
+        st.session_state.session_id = result['session_id']
+        st.session_state.messages = [
+            {"role": "assistant", "content": result['welcome_message']}
+        ]
+
 # 学生端 - 学习对话界面
 def render_learning_interface():
     """渲染学习对话界面"""
@@ -334,20 +527,12 @@ def render_learning_interface():
         st.markdown("### 📊 学习状态")
 
         # 返回按钮
-        if st.button("← 返回选择科目", use_container_width=True):
-            st.session_state.current_subject = None
-            st.session_state.session_id = None
-            st.session_state.messages = []
-            st.rerun()
+        st.button("← 返回选择科目", use_container_width=True, on_click=_leave_subject)
 
         st.markdown("---")
 
         # 当前科目
-        subject_names = {
-            "chinese": "📖 语文", "math": "📐 数学", "english": "🌍 英语",
-            "history": "🏛️ 历史", "politics": "⚖️ 政治"
-        }
-        st.markdown(f"**当前科目：** {subject_names.get(st.session_state.current_subject, '未知')}")
+        st.markdown(f"**当前科目：** {_SUBJECT_LABELS.get(st.session_state.current_subject, '未知')}")
 
         # 掌握度进度条
         st.markdown("**掌握度**")
@@ -357,19 +542,8 @@ def render_learning_interface():
 
         st.markdown("---")
 
-        # 直觉泵/提示
-        st.markdown("### 💡 学习提示")
-        tips = get_learning_tips(st.session_state.current_subject)
-        for tip in tips:
-            st.info(tip)
-
-        st.markdown("---")
-
-        # 常见误区
-        st.markdown("### ⚠️ 常见误区")
-        mistakes = get_common_mistakes(st.session_state.current_subject)
-        for mistake in mistakes:
-            st.warning(mistake)
+        # 直觉泵/提示 + 常见误区：只随科目变化，整块 HTML 一次输出
+        st.markdown(_sidebar_tips_html(st.session_state.current_subject), unsafe_allow_html=True)
 
     # 主内容区 - 对话界面
     st.markdown("### 💬 AI 导师对话")
@@ -378,98 +552,114 @@ def render_learning_interface():
     chat_container = st.container()
 
     with chat_container:
-        for msg in st.session_state.messages:
-            if msg["role"] == "user":
-                with st.chat_message("user", avatar="👨‍🎓"):
-                    st.markdown(msg["content"])
-            else:
-                with st.chat_message("assistant", avatar="🤖"):
-                    st.markdown(msg["content"])
-
-    # 输入区
-    if prompt := st.chat_input("输入你的问题或回答..."):
-        # 添加用户消息
-        st.session_state.messages.append({"role": "user", "content": prompt})
-
-        # 发送到后端
-        with st.spinner("AI 导师思考中..."):
-            result = api_post("/api/chat", {
-                "session_id": st.session_state.session_id,
-                "message": prompt,
-                "student_id": "streamlit_user"
-            })
+        # 只展开最近 CHAT_WINDOW 条，更早的折叠起来，每次 rerun 的渲染量不随对话变长
+        messages = st.session_state.messages
+        older, recent = messages[:-CHAT_WINDOW], messages[-CHAT_WINDOW:]
+        if older:
+            with st.expander(f"查看更早的 {len(older)} 条消息"):
+                for msg in older:
+                    _render_chat_message(msg)
+        for msg in recent:
+            _render_chat_message(msg)
+
+    # 输入区：快捷按钮的回调只登记待发消息，与输入框走同一条流式路径
+    pending = st.session_state.pop("pending_message", None)
+    if prompt := st.chat_input("输入你的问题或回答...") or pending:
+        # 流式输出：边生成边渲染，结束后写入会话状态，下次 rerun 按历史渲染
+        with chat_container:
+            with st.chat_message("user", avatar="👨‍🎓"):
+                st.markdown(prompt)
+            with st.chat_message("assistant", avatar="🤖"):
+                mastery_before = st.session_state.mastery_level
+                result = _stream_user_message(prompt)
+        # 侧边栏的掌握度本轮已渲染过，有变化时刷新一次（掌握时保留气球动画，不刷新）
+        if result and st.session_state.mastery_level != mastery_before and not result.get('mastered'):
+            st.rerun()
 
-        if result:
-            # 添加助手回复
-            st.session_state.messages.append({
-                "role": "assistant",
-                "content": result['response']
-            })
+    # 快捷操作按钮：回调在点击触发的 rerun 开始前执行，只登记消息，不在回调里阻塞等待回复
+    st.markdown("---")
+    cols = st.columns(len(_QUICK_ACTIONS) + 1)
+    for col, (label, text) in zip(cols, _QUICK_ACTIONS):
+        col.button(label, use_container_width=True, on_click=_queue_user_message, args=(text,))
+    cols[-1].button("🔄 清空对话", use_container_width=True, on_click=_restart_session)
 
-            # 更新掌握度
-            if result.get('grade') == 'A':
-                st.session_state.mastery_level = min(100, st.session_state.mastery_level + 20)
-            elif result.get('grade') == 'B':
-                st.session_state.mastery_level = min(100, st.session_state.mastery_level + 10)
 
-            # 检查是否掌握
-            if result.get('mastered'):
-                st.balloons()
+def _render_chat_message(msg: Dict[str, str]):
+    """渲染一条历史消息"""
+    avatar = "👨‍🎓" if msg["role"] == "user" else "🤖"
+    with st.chat_message(msg["role"], avatar=avatar):
+        st.markdown(msg["content"])
 
-            st.rerun()
 
-    # 快捷操作按钮
-    st.markdown("---")
-    cols = st.columns(4)
-    with cols[0]:
-        if st.button("📝 开始练习", use_container_width=True):
-            st.session_state.messages.append({"role": "user", "content": "我想做一些练习题"})
-            result = api_post("/api/chat", {
-                "session_id": st.session_state.session_id,
-                "message": "我想做一些练习题",
-                "student_id": "streamlit_user"
-            })
-            if result:
-                st.session_state.messages.append({"role": "assistant", "content": result['response']})
-                st.rerun()
-
-    with cols[1]:
-        if st.button("💡 给我提示", use_container_width=True):
-            st.session_state.messages.append({"role": "user", "content": "给我一些提示"})
-            result = api_post("/api/chat", {
-                "session_id": st.session_state.session_id,
-                "message": "给我一些提示",
-                "student_id": "streamlit_user"
-            })
-            if result:
-                st.session_state.messages.append({"role": "assistant", "content": result['response']})
-                st.rerun()
-
-    with cols[2]:
-        if st.button("📖 知识总结", use_container_width=True):
-            st.session_state.messages.append({"role": "user", "content": "请帮我总结一下今天学习的内容"})
-            result = api_post("/api/chat", {
+def _queue_user_message(text: str):
+    """登记一条待发送的用户消息，由本次 rerun 的对话区流式发送"""
+    st.session_state.pending_message = text
+
+
+def _apply_chat_result(result: Dict):
+    """把一轮对话的结果写入会话状态"""
+    # 添加助手回复
+    st.session_state.messages.append({"role": "assistant", "content": result['response']})
+
+    # 更新掌握度
+    if result.get('grade') == 'A':
+        st.session_state.mastery_level = min(100, st.session_state.mastery_level + 20)
+    elif result.get('grade') == 'B':
+        st.session_state.mastery_level = min(100, st.session_state.mastery_level + 10)
+
+    # 检查是否掌握
+    if result.get('mastered'):
+        st.balloons()
+
+
+def _stream_user_message(text: str) -> Optional[Dict]:
+    """以 SSE 发送用户消息并在当前位置逐字渲染回复；结束后把回复与掌握度变化写入会话状态"""
+    st.session_state.messages.append({"role": "user", "content": text})
+    final: Dict[str, Any] = {}
+
+    def deltas() -> Iterator[str]:
+        try:
+            for event in api_post_stream("/api/chat/stream", {
                 "session_id": st.session_state.session_id,
-                "message": "请帮我总结一下今天学习的内容",
+                "message": text,
                 "student_id": "streamlit_user"
-            })
-            if result:
-                st.session_state.messages.append({"role": "assistant", "content": result['response']})
-                st.rerun()
-
-    with cols[3]:
-        if st.button("🔄 清空对话", use_container_width=True):
-            # 重新创建会话
-            result = api_post("/api/sessions", {
-                "student_id": "streamlit_user",
-                "subject": st.session_state.current_subject
-            })
-            if result:
-                st.session_state.session_id = result['session_id']
-                st.session_state.messages = [
-                    {"role": "assistant", "content": result['welcome_message']}
-                ]
-                st.rerun()
+            }):
+                if "delta" in event:
+                    yield event["delta"]
+                elif event.get("done"):
+                    final.update(event["result"])
+                elif "error" in event:
+                    st.error(f"API 请求失败: {event['error']}")
+        except Exception as e:
+            st.error(f"API 请求失败: {e}")
+
+    st.write_stream(deltas())
+    if not final:
+        return None
+    _apply_chat_result(final)
+    return final
+
+
+def _restart_session():
+    """重新创建会话（清空对话）"""
+    result = api_post("/api/sessions", {
+        "student_id": "streamlit_user",
+        "subject": st.session_state.current_subject
+    })
+    if result:
+        st.session_state.session_id = result['session_id']
+        st.session_state.messages = [
+            {"role": "assistant", "content": result['welcome_message']}
+        ]
+
+
+@st.cache_data(show_spinner=False)
+def _sidebar_tips_html(subject: str) -> str:
+    """侧边栏学习提示与常见误区 HTML，按科目缓存"""
+    tips = "".join(f'<div class="sidebar-tip">{tip}</div>' for tip in get_learning_tips(subject))
+    mistakes = "".join(f'<div class="sidebar-mistake">{m}</div>' for m in get_common_mistakes(subject))
+    return (f"<h3>💡 学习提示</h3>{tips}<hr>"
+            f"<h3>⚠️ 常见误区</h3>{mistakes}")
 
 
 def get_grade_display(progress: float) -> str:
@@ -482,28 +672,14 @@ def get_grade_display(progress: float) -> str:
         return "C 📚 学习中"
 
 
-def get_learning_tips(subject: str) -> List[str]:
+def get_learning_tips(subject: str) -> Tuple[str, ...]:
     """获取学习提示"""
-    tips = {
-        "chinese": ["多读多写是提高语文的关键", "理解文章要先了解作者背景"],
-        "math": ["先理解概念再做题", "画图可以帮助理解几何问题"],
-        "english": ["每天背诵10个单词", "多听英语培养语感"],
-        "history": ["用时间线梳理历史事件", "理解历史要看因果关系"],
-        "politics": ["结合时事理解理论", "注意概念之间的联系"],
-    }
-    return tips.get(subject, ["认真学习，持之以恒"])
+    return _LEARNING_TIPS.get(subject, ("认真学习，持之以恒",))
 
 
-def get_common_mistakes(subject: str) -> List[str]:
+def get_common_mistakes(subject: str) -> Tuple[str, ...]:
     """获取常见误区"""
-    mistakes = {
-        "chinese": ["混淆比喻和拟人"],
-        "math": ["公式符号使用错误"],
-        "english": ["时态使用混乱"],
-        "history": ["时间点记忆混淆"],
-        "politics": ["概念理解表面化"],
-    }
-    return mistakes.get(subject, ["粗心大意"])
+    return _COMMON_MISTAKES.get(subject, ("粗心大意",))
 
 
 # ============================================
@@ -515,7 +691,7 @@ def render_admin_dashboard():
     st.markdown("### 📊 数据看板")
 
     # 获取统计数据
-    stats = api_get("/api/admin/stats")
+    stats = api_get_cached("/api/admin/stats")
 
     if stats:
         # 核心指标
@@ -531,19 +707,19 @@ def render_admin_dashboard():
             with cols[i]:
                 st.metric(label=label, value=f"{value}{unit}")
 
+        prompt_tokens = stats.get('prompt_tokens', 0)
+        if prompt_tokens:
+            cached = stats.get('cached_prompt_tokens', 0)
+            st.caption(f"🧠 提示词前缀缓存命中：{cached} / {prompt_tokens} tokens（{cached / prompt_tokens * 100:.1f}%）")
+
         st.markdown("---")
 
         # 学科统计
         st.markdown("### 📊 各学科数据")
         subject_stats = stats.get('subject_stats', {})
 
-        subject_names = {
-            "chinese": "语文", "math": "数学", "english": "英语",
-            "history": "历史", "politics": "政治"
-        }
-
         cols = st.columns(5)
-        for i, (subj_id, subj_name) in enumerate(subject_names.items()):
+        for i, (subj_id, subj_name) in enumerate(_SUBJECT_NAMES.items()):
             with cols[i]:
                 subj_data = subject_stats.get(subj_id, {})
                 st.markdown(f"**{subj_name}**")
@@ -565,36 +741,27 @@ def render_question_management():
         with cols[0]:
             filter_subject = st.selectbox(
                 "学科",
-                ["全部", "chinese", "math", "english", "history", "politics"],
-                format_func=lambda x: {"全部": "全部", "chinese": "语文", "math": "数学",
-                                       "english": "英语", "history": "历史", "politics": "政治"}.get(x, x)
+                _SUBJECT_FILTER_OPTIONS,
+                format_func=_SUBJECT_FILTER_NAMES.get
             )
         with cols[1]:
             filter_type = st.selectbox(
                 "题型",
-                ["全部", "choice", "judgment", "qa", "fill", "application"],
-                format_func=lambda x: {"全部": "全部", "choice": "选择题", "judgment": "判断题",
-                                       "qa": "问答题", "fill": "填空题", "application": "应用题"}.get(x, x)
+                _QUESTION_TYPE_FILTER_OPTIONS,
+                format_func=_QUESTION_TYPE_FILTER_NAMES.get
             )
         with cols[2]:
             filter_difficulty = st.selectbox("难度", ["全部", "1", "2", "3", "4", "5"])
 
         # 获取题目
-        endpoint = "/api/questions"
-        params = []
-        if filter_subject != "全部":
-            params.append(f"subject={filter_subject}")
-        if filter_type != "全部":
-            params.append(f"question_type={filter_type}")
-        if filter_difficulty != "全部":
-            params.append(f"difficulty={filter_difficulty}")
-
-        if params:
-            endpoint += "?" + "&".join(params)
+        page = st.number_input("页码", min_value=1, step=1, key="question_page")
+        questions, total = api_get_page("/api/questions", page, {
+            "subject": filter_subject,
+            "question_type": filter_type,
+            "difficulty": filter_difficulty
+        })
 
-        questions = api_get(endpoint) or []
-
-        st.markdown(f"共 **{len(questions)}** 道题目")
+        st.markdown(f"共 **{total}** 道题目（第 {page}/{max(1, -(-total // PAGE_SIZE))} 页）")
 
         for q in questions:
             with st.expander(f"📝 {q['content'][:50]}..." if len(
@@ -612,6 +779,7 @@ def render_question_management():
                 with cols[1]:
                     if st.button("🗑️ 删除", key=f"del_q_{q['id']}"):
                         if api_delete(f"/api/questions/{q['id']}"):
+                            _cached_get.clear()
                             st.success("删除成功")
                             st.rerun()
 
@@ -623,17 +791,15 @@ def render_question_management():
             with cols[0]:
                 new_subject = st.selectbox(
                     "学科 *",
-                    ["chinese", "math", "english", "history", "politics"],
-                    format_func=lambda x: {"chinese": "语文", "math": "数学",
-                                           "english": "英语", "history": "历史", "politics": "政治"}.get(x, x),
+                    _SUBJECT_IDS,
+                    format_func=_SUBJECT_NAMES.get,
                     key="new_q_subject"
                 )
             with cols[1]:
                 new_type = st.selectbox(
                     "题型 *",
-                    ["choice", "judgment", "qa", "fill", "application"],
-                    format_func=lambda x: {"choice": "选择题", "judgment": "判断题",
-                                           "qa": "问答题", "fill": "填空题", "application": "应用题"}.get(x, x),
+                    _QUESTION_TYPES,
+                    format_func=_QUESTION_TYPE_NAMES.get,
                     key="new_q_type"
                 )
 
@@ -672,6 +838,7 @@ def render_question_management():
                     })
 
                     if result:
+                        _cached_get.clear()
                         st.success("✅ 题目添加成功！")
                         st.rerun()
                 else:
@@ -691,20 +858,16 @@ def render_knowledge_management():
         with cols[0]:
             filter_subject = st.selectbox(
                 "学科筛选",
-                ["全部", "chinese", "math", "english", "history", "politics"],
-                format_func=lambda x: {"全部": "全部", "chinese": "语文", "math": "数学",
-                                       "english": "英语", "history": "历史", "politics": "政治"}.get(x, x),
+                _SUBJECT_FILTER_OPTIONS,
+                format_func=_SUBJECT_FILTER_NAMES.get,
                 key="knowledge_filter_subject"
             )
 
         # 获取知识点
-        endpoint = "/api/knowledge"
-        if filter_subject != "全部":
-            endpoint += f"?subject={filter_subject}"
-
-        knowledge_items = api_get(endpoint) or []
+        page = st.number_input("页码", min_value=1, step=1, key="knowledge_page")
+        knowledge_items, total = api_get_page("/api/knowledge", page, {"subject": filter_subject})
 
-        st.markdown(f"共 **{len(knowledge_items)}** 条知识点")
+        st.markdown(f"共 **{total}** 条知识点（第 {page}/{max(1, -(-total // PAGE_SIZE))} 页）")
 
         for k in knowledge_items:
             with st.expander(f"📖 {k.get('title', '无标题')}"):
@@ -718,6 +881,7 @@ def render_knowledge_management():
                 with cols[1]:
                     if st.button("🗑️ 删除", key=f"del_k_{k['id']}"):
                         if api_delete(f"/api/knowledge/{k['id']}"):
+                            _cached_get.clear()
                             st.success("删除成功")
                             st.rerun()
 
@@ -729,16 +893,15 @@ def render_knowledge_management():
             with cols[0]:
                 new_subject = st.selectbox(
                     "学科 *",
-                    ["chinese", "math", "english", "history", "politics"],
-                    format_func=lambda x: {"chinese": "语文", "math": "数学",
-                                           "english": "英语", "history": "历史", "politics": "政治"}.get(x, x),
+                    _SUBJECT_IDS,
+                    format_func=_SUBJECT_NAMES.get,
                     key="new_k_subject"
                 )
             with cols[1]:
                 new_source_type = st.selectbox(
                     "来源类型",
-                    ["text", "pdf", "link"],
-                    format_func=lambda x: {"text": "文本", "pdf": "PDF", "link": "链接"}.get(x, x),
+                    _SOURCE_TYPES,
+                    format_func=_SOURCE_TYPE_NAMES.get,
                     key="new_k_source"
                 )
 
@@ -776,6 +939,7 @@ def render_knowledge_management():
                     })
 
                     if result:
+                        _cached_get.clear()
                         st.success("✅ 知识点添加成功！")
                         st.rerun()
                 else:
@@ -783,11 +947,17 @@ def render_knowledge_management():
 
 # 管理端 - 系统日志
 
+@st.fragment(run_every=5)
 def render_system_logs():
-    """渲染系统日志"""
+    """渲染系统日志（每 5 秒只拉取新增日志，局部刷新）"""
     st.markdown("### 📋 系统日志")
 
-    logs = api_get("/api/admin/logs?limit=50") or []
+    since = st.session_state.get("last_log_seq", 0)
+    new_logs = api_get(f"/api/admin/logs?since={since}&limit=50") or []
+    if new_logs:
+        st.session_state.admin_logs = (new_logs + st.session_state.get("admin_logs", []))[:50]
+        st.session_state.last_log_seq = new_logs[0]["seq"]
+    logs = st.session_state.get("admin_logs", [])
 
     if not logs:
         st.info("暂无日志记录")
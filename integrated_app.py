@@ -9,22 +9,21 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import uvicorn
+import atexit
 import threading
-import time
 import requests
 import sys
 import os
-import socket
 
 # 添加当前目录到Python路径，确保能正确导入模块
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 # 导入项目模块
-from config import SYSTEM_NAME, SYSTEM_VERSION, BACKEND_HOST, BACKEND_PORT, validate_config
+from config import SYSTEM_NAME, SYSTEM_VERSION, BACKEND_HOST, BACKEND_PORT, BACKEND_ACCESS_LOG, validate_config
 from backend import app as fastapi_app
 from frontend import (render_header, render_subject_selection, render_learning_interface, 
                      render_admin_dashboard, render_question_management, render_knowledge_management,
-                     render_system_logs, init_session_state, load_custom_css)
+                     render_system_logs, init_session_state, load_custom_css, _http_session)
 
 # 页面配置
 st.set_page_config(
@@ -35,10 +34,10 @@ st.set_page_config(
 )
 
 # 禁用Streamlit开发者工具和调试信息
-st.session_state['debug_mode'] = False
+st.session_state.setdefault('debug_mode', False)
 
-# 隐藏Streamlit调试信息和开发者工具
-css = '''
+# 隐藏Streamlit调试信息和开发者工具（静态样式直接写成完整 <style> 块，免去每次 rerun 拼接）
+_HIDE_DEBUG_CSS = '''<style>
 /* 隐藏调试工具栏和调试信息 */
 [data-testid="stToolbar"] { display: none !important; }
 [data-testid="stToolbarActions"] { display: none !important; }
@@ -46,56 +45,91 @@ footer { visibility: hidden !important; }
 .stApp > header { display: none !important; }
 *[data-testid*="debug"], *[data-testid*="tool"] { display: none !important; }
 [data-testid="stAppViewBlockContainer"] { padding-left: 1rem !important; max-width: 100% !important; }
-'''
-st.markdown(f'<style>{css}</style>', unsafe_allow_html=True)
+</style>'''
+st.markdown(_HIDE_DEBUG_CSS, unsafe_allow_html=True)
 
 # 加载自定义CSS
 load_custom_css()
 
 # 启动FastAPI后端服务
-def start_backend():
-    """启动FastAPI后端服务"""
-    uvicorn.run(fastapi_app, host=BACKEND_HOST, port=BACKEND_PORT, log_level="info")
-
-# 检查后端服务是否可用
-def wait_for_service(host, port, timeout=30, interval=1):
-    """等待服务启动(替代固定sleep)"""
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.connect((host, port))
-                return True
-        except (ConnectionRefusedError, OSError):
-            time.sleep(interval)
-    return False
+class _ReadyServer(uvicorn.Server):
+    """端口开始监听时置位 ready 事件，启动方无需轮询端口"""
+
+    def __init__(self, config: uvicorn.Config, ready: threading.Event):
+        super().__init__(config)
+        self.ready = ready
+
+    async def startup(self, sockets=None):
+        await super().startup(sockets=sockets)
+        self.ready.set()
+
+def start_backend(server: _ReadyServer):
+    """启动FastAPI后端服务（Server.run 在本线程新建事件循环；非主线程不安装信号处理）"""
+    try:
+        server.run()
+    finally:
+        # 启动失败（如端口被占用）退出时同样唤醒等待方
+        server.ready.set()
+
+def stop_backend(server: _ReadyServer, thread: threading.Thread, timeout: float = 5):
+    """通知后端退出并等待其执行完 lifespan 收尾（关闭 LLM 连接池）"""
+    server.should_exit = True
+    thread.join(timeout)
+
+@st.cache_resource(show_spinner=False)
+def _launch_backend() -> _ReadyServer:
+    """每个进程只启动一次后端；脚本 rerun 时直接复用同一 Server 实例"""
+    server = _ReadyServer(
+        uvicorn.Config(fastapi_app, host=BACKEND_HOST, port=BACKEND_PORT, log_level="info",
+                       access_log=BACKEND_ACCESS_LOG),
+        threading.Event()
+    )
+    backend_thread = threading.Thread(target=start_backend, args=(server,), daemon=True)
+    backend_thread.start()
+    # 守护线程不会被解释器等待，退出时主动让 uvicorn 优雅关闭
+    atexit.register(stop_backend, server, backend_thread)
+
+    # 等待服务启动：监听就绪即刻返回
+    server.ready.wait(timeout=30)
+    return server
 
 def check_backend_health():
     """检查后端服务是否可用"""
     try:
-        response = requests.get(f"http://{BACKEND_HOST}:{BACKEND_PORT}/api/health", timeout=5)
+        response = _http_session().get(f"http://{BACKEND_HOST}:{BACKEND_PORT}/api/health", timeout=5)
         return response.status_code == 200
     except requests.exceptions.RequestException:
         return False
 
+@st.cache_data(ttl=5, show_spinner=False)
+def _cached_backend_health():
+    """5 秒内的 rerun 复用同一次健康检查结果"""
+    return check_backend_health()
+
 def start_backend_service():
     """启动后端服务并返回启动状态"""
     # 检查后端服务是否已经在运行
-    if check_backend_health():
+    if _cached_backend_health():
         return True
     
     # 启动后端服务
     try:
-        # 使用线程启动后端服务
-        backend_thread = threading.Thread(target=start_backend, daemon=True)
-        backend_thread.start()
-        
-        # 等待服务启动
-        return wait_for_service(BACKEND_HOST, BACKEND_PORT)
+        server = _launch_backend()
+        if not server.started:
+            # 启动失败不保留该实例，下次 rerun 可重试
+            _launch_backend.clear()
+        # 丢弃启动前缓存的"不可用"结果
+        _cached_backend_health.clear()
+        return server.started
     except Exception as e:
         st.error(f"启动后端服务时出错: {str(e)}")
         return False
 
+@st.cache_resource(show_spinner=False)
+def _config_valid() -> bool:
+    """每个进程只校验一次配置，rerun 时复用结果，不再重复打印警告"""
+    return validate_config()
+
 # 主界面函数
 def main():
     """主界面函数"""
@@ -132,7 +166,7 @@ def main():
 def run_app():
     """运行应用程序"""
     # 检查配置
-    if not validate_config():
+    if not _config_valid():
         st.warning("⚠️ 配置不完整(如API_KEY缺失)，可能导致部分功能无法使用")
     
     # 启动后端服务
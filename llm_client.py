@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+AI 智能学习操作系统 - LLM 客户端
+Shared LLM client with pooled connections
+"""
+
+import importlib.util
+from typing import Any
+
+import httpx
+from langchain_openai import ChatOpenAI
+
+from config import (
+    API_KEY, API_BASE_URL, MODEL_NAME,
+    LLM_TEMPERATURE, LLM_TIMEOUT, LLM_MAX_CONNECTIONS, LLM_MAX_KEEPALIVE_CONNECTIONS, LLM_HTTP2
+)
+
+# HTTP/2 依赖 h2 包，未安装时退回 HTTP/1.1 keep-alive
+_use_http2 = LLM_HTTP2 and importlib.util.find_spec("h2") is not None
+
+_limits = httpx.Limits(
+    max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+    max_connections=LLM_MAX_CONNECTIONS
+)
+
+# 所有 Agent 共用异步连接池（Agent 只走异步调用），热路径上复用 keep-alive 连接，省去 TCP/TLS 握手
+_http_async_client = httpx.AsyncClient(limits=_limits, timeout=LLM_TIMEOUT, http2=_use_http2)
+
+shared_llm = ChatOpenAI(
+    api_key=API_KEY,
+    base_url=API_BASE_URL,
+    model=MODEL_NAME,
+    temperature=LLM_TEMPERATURE,
+    max_tokens=2000,
+    # 流式调用默认不返回 usage，显式开启后最后一个分片携带 token 用量
+    stream_usage=True,
+    http_async_client=_http_async_client
+)
+
+
+def get_llm(temperature: float = LLM_TEMPERATURE) -> Any:
+    """获取共享 LLM；温度不同时通过 bind 覆盖请求参数，仍复用同一连接池"""
+    if temperature == LLM_TEMPERATURE:
+        return shared_llm
+    return shared_llm.bind(temperature=temperature)
+
+
+async def aclose_llm_client() -> None:
+    """关闭共享连接池（服务退出时调用）"""
+    await _http_async_client.aclose()
@@ -4,12 +4,19 @@ AI 智能学习操作系统 - 数据模型
 Pydantic models for data validation and serialization
 """
 
-from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any, Literal
+from pydantic import BaseModel, ConfigDict, Field, field_validator, model_validator
+from typing import Optional, List, Dict, Any, Literal, Deque
+from collections import deque
 from datetime import datetime
 from enum import Enum
 import uuid
 
+from config import SESSION_MAX_MESSAGES
+
+def new_id() -> str:
+    """生成对象 ID：随机 UUID4 的 32 位十六进制形式（省去连字符格式化）"""
+    return uuid.uuid4().hex
+
 # 枚举类型
 class Subject(str, Enum):
     """学科枚举"""
@@ -44,7 +51,7 @@ class SessionState(str, Enum):
 # 基础模型
 class Question(BaseModel):
     """题目模型"""
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = Field(default_factory=new_id)
     subject: Subject
     topic_id: str
     topic_name: str
@@ -57,12 +64,11 @@ class Question(BaseModel):
     is_transfer: bool = False  # 是否为迁移测试题
     created_at: datetime = Field(default_factory=datetime.now)
 
-    class Config:
-        use_enum_values = True
+    model_config = ConfigDict(use_enum_values=True)
 
 class KnowledgeItem(BaseModel):
     """知识点模型"""
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = Field(default_factory=new_id)
     subject: Subject
     topic_id: str
     topic_name: str
@@ -76,8 +82,7 @@ class KnowledgeItem(BaseModel):
     tags: List[str] = []
     created_at: datetime = Field(default_factory=datetime.now)
 
-    class Config:
-        use_enum_values = True
+    model_config = ConfigDict(use_enum_values=True)
 
 class StudentProgress(BaseModel):
     """学生进度模型"""
@@ -91,24 +96,50 @@ class StudentProgress(BaseModel):
     transfer_passed: bool = False
     last_activity: datetime = Field(default_factory=datetime.now)
 
-    class Config:
-        use_enum_values = True
+    model_config = ConfigDict(use_enum_values=True)
 
 class Session(BaseModel):
     """学习会话模型"""
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = Field(default_factory=new_id)
     student_id: str
     subject: Subject
     topic_id: Optional[str] = None
     state: SessionState = SessionState.LEARNING
     current_grade: GradeLevel = GradeLevel.C
     consecutive_failures: int = 0
-    messages: List[Dict[str, str]] = []
+    current_question_id: Optional[str] = None  # 当前作答的题目
+    # 只在内存中保留最近 SESSION_MAX_MESSAGES 条，更早的自动淘汰
+    messages: Deque[Dict[str, str]] = Field(default_factory=lambda: deque(maxlen=SESSION_MAX_MESSAGES))
+    message_total: int = 0  # 累计消息条数（含已淘汰的）
+    history_summary: str = ""  # 较早对话的滚动摘要
+    summarized_count: int = 0  # 累计已折叠进摘要的条数
     created_at: datetime = Field(default_factory=datetime.now)
     updated_at: datetime = Field(default_factory=datetime.now)
 
-    class Config:
-        use_enum_values = True
+    model_config = ConfigDict(use_enum_values=True)
+
+    @field_validator("messages", mode="after")
+    @classmethod
+    def _bound_messages(cls, v: Deque[Dict[str, str]]) -> Deque[Dict[str, str]]:
+        if v.maxlen == SESSION_MAX_MESSAGES:
+            return v
+        return deque(v, maxlen=SESSION_MAX_MESSAGES)
+
+    @model_validator(mode="after")
+    def _sync_message_total(self) -> "Session":
+        if self.message_total < len(self.messages):
+            self.message_total = len(self.messages)
+        return self
+
+    @property
+    def evicted_count(self) -> int:
+        """已被淘汰出内存的消息条数"""
+        return self.message_total - len(self.messages)
+
+    def add_message(self, role: str, content: str) -> None:
+        """追加一条消息（O(1)，超出上限时淘汰最早的）"""
+        self.messages.append({"role": role, "content": content})
+        self.message_total += 1
 
 # API 请求/响应模型
 class ChatRequest(BaseModel):
@@ -151,6 +182,8 @@ class QuestionCreateRequest(BaseModel):
     explanation: str
     is_transfer: bool = False
 
+    model_config = ConfigDict(use_enum_values=True)
+
 class KnowledgeCreateRequest(BaseModel):
     """创建知识点请求"""
     subject: Subject
@@ -165,22 +198,27 @@ class KnowledgeCreateRequest(BaseModel):
     source_url: Optional[str] = None
     tags: List[str] = []
 
+    model_config = ConfigDict(use_enum_values=True)
+
 class DashboardStats(BaseModel):
     """管理端数据统计"""
     active_students: int
     knowledge_count: int
     question_count: int
     ai_interactions: int
+    prompt_tokens: int = 0  # LLM 输入 token 总数
+    cached_prompt_tokens: int = 0  # 命中服务端前缀缓存的输入 token
     average_mastery: float
     subject_stats: Dict[str, Dict[str, Any]]
 
 class SystemLog(BaseModel):
     """系统日志"""
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = Field(default_factory=new_id)
     timestamp: datetime = Field(default_factory=datetime.now)
     log_type: Literal["info", "warning", "error", "success"]
     message: str
     details: Optional[Dict[str, Any]] = None
+    seq: int = 0  # 递增序号，供管理端增量拉取
 
 class AnswerSubmission(BaseModel):
     """答案提交"""
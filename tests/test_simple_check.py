@@ -0,0 +1,24 @@
+"""规则判分（_simple_check）的回归用例"""
+
+import pytest
+
+from agents import _simple_check
+
+
+@pytest.mark.parametrize("correct, answer", [
+    ("-3/2, -1", "3/2, 1"),
+    ("-3/2, -1", "1 2 3"),
+    ("x=5", "x=3"),
+])
+def test_rejects_wrong_signs_and_numbers(correct, answer):
+    assert not _simple_check("fill", correct, answer)
+
+
+@pytest.mark.parametrize("correct, answer", [
+    ("-3/2, -1", "-3/2，-1"),
+    ("-3/2, -1", "x=-3/2或x=-1"),
+    ("x=5", "X = 5"),
+    ("光合作用把光能转化为化学能", "光合作用将光能转成化学能"),
+])
+def test_accepts_equivalent_answers(correct, answer):
+    assert _simple_check("fill", correct, answer)
@@ -0,0 +1,44 @@
+"""流式调用的 token 用量统计"""
+
+import asyncio
+
+from langchain_core.messages import AIMessageChunk
+
+from agents import TeachingAgent
+from database import db
+from llm_client import shared_llm
+
+
+class _StubStreamLLM:
+    """按 OpenAI 流式接口的形态产出分片：用量只在最后一个分片上"""
+
+    async def astream(self, messages):
+        yield AIMessageChunk(content="你好")
+        yield AIMessageChunk(content="，同学")
+        yield AIMessageChunk(
+            content="",
+            usage_metadata={
+                "input_tokens": 120,
+                "output_tokens": 4,
+                "total_tokens": 124,
+                "input_token_details": {"cache_read": 96},
+            },
+        )
+
+
+def test_shared_llm_requests_stream_usage():
+    assert shared_llm.stream_usage is True
+
+
+def test_streamed_call_records_usage(monkeypatch):
+    agent = TeachingAgent()
+    monkeypatch.setattr(agent, "_llm_for", lambda *args, **kwargs: _StubStreamLLM())
+    prompt_tokens, cached_tokens = db.prompt_tokens, db.cached_prompt_tokens
+
+    async def collect():
+        messages = [{"role": "user", "content": "讲讲勾股定理"}]
+        return [delta async for delta in agent._astream_llm(messages)]
+
+    assert "".join(asyncio.run(collect())) == "你好，同学"
+    assert db.prompt_tokens - prompt_tokens == 120
+    assert db.cached_prompt_tokens - cached_tokens == 96